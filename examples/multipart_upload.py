@@ -32,4 +32,18 @@ for part in range(0, my_archive.partcount):
 # Finally, send the complete archive command
 example_vault.complete_multipart_upload(my_archive)
 
+# All of the above can be done in one go as well, with several parts
+# being sent at the same time:
+#archive_id, timings = example_vault.upload_multipart(my_archive, concurrency=4)
+#
+# With a journal an interrupted upload is resumed by simply running the
+# same command again, only the missing parts are sent:
+#archive_id, timings = example_vault.upload_multipart(my_archive,
+#	concurrency=4, journal="example.txt.journal")
+#
+# Data produced on the fly, e.g. "tar c dir | python upload.py", can be
+# streamed without writing it to disk first:
+#import sys
+#stream_archive = example_vault.upload_stream(sys.stdin, concurrency=4)
+
 print "Success! The ID of your just uploaded file is " + my_archive.id
@@ -0,0 +1,153 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import sys, time, threading, Queue
+
+class AdaptiveConcurrency(object):
+	"""
+
+		Number of transfers allowed in flight, tuned while they run.
+
+		The limit grows by one (additive increase) after every window of
+		successful transfers whose throughput didn't drop, it shrinks by
+		one if the throughput dropped and it is cut in half after an
+		error (multiplicative decrease). A window is as many transfers as
+		the limit allows at once.
+
+		One instance can be shared by several uploads, the next upload
+		then starts at the limit the last one found.
+
+	"""
+
+	def __init__(self, initial=4, minimum=1, maximum=16, decrease=0.5,
+		tolerance=0.05):
+		"""
+            :param initial: Limit to start with
+			:param minimum: Lowest limit
+			:param maximum: Highest limit, also the number of threads
+			:param decrease: Factor the limit is cut by after an error
+			:param tolerance: Share the throughput of a window may fall
+			below the last one before the limit is decreased
+        """
+		self.limit = max(minimum, min(initial, maximum))
+		self.minimum = minimum
+		self.maximum = maximum
+		self.decrease = decrease
+		self.tolerance = tolerance
+		self.in_flight = 0
+		self.throughput = 0.0
+		self.errors = 0
+		# (time, limit) after every change
+		self.history = [(time.time(), self.limit)]
+		self._condition = threading.Condition()
+		self._reset_window()
+
+	def _reset_window(self):
+		self.window_start = time.time()
+		self.window_bytes = 0
+		self.window_count = 0
+
+	def _set_limit(self, limit):
+		limit = max(self.minimum, min(self.maximum, int(limit)))
+		if limit != self.limit:
+			self.limit = limit
+			self.history.append((time.time(), limit))
+			self._condition.notify_all()
+
+	def acquire(self):
+		"""
+            Waits until one more transfer may start
+        """
+		with self._condition:
+			while self.in_flight >= self.limit:
+				self._condition.wait()
+			self.in_flight += 1
+
+	def release(self, size=None, error=False):
+		"""
+            Ends a transfer and adjusts the limit
+
+			:param size: Bytes transferred, None if the transfer didn't
+			happen at all
+			:param error: Whether the transfer failed
+        """
+		with self._condition:
+			self.in_flight -= 1
+			self._condition.notify()
+			if error:
+				self.errors += 1
+				self._set_limit(self.limit * self.decrease)
+				self._reset_window()
+			elif size is not None:
+				self.window_bytes += size
+				self.window_count += 1
+				if self.window_count >= self.limit:
+					elapsed = max(time.time() - self.window_start, 1e-6)
+					throughput = self.window_bytes / elapsed
+					if throughput < self.throughput * (1 - self.tolerance):
+						self._set_limit(self.limit - 1)
+					else:
+						self._set_limit(self.limit + 1)
+					self.throughput = throughput
+					self._reset_window()
+
+def run_adaptive(func, items, concurrency, attempts=3, retryable=None,
+	delay=None):
+	"""
+		Calls func for each item with as many calls in flight as the
+		AdaptiveConcurrency allows. func returns the number of bytes it
+		transferred. A failed item is tried again up to ``attempts``
+		times in all, then the error is raised with its traceback.
+
+		func should not retry by itself, every failure it raises lowers
+		the limit. Errors ``retryable`` (e.g. RetryPolicy.retryable)
+		returns False for are raised right away. ``delay`` (e.g.
+		RetryPolicy.delay) returns the seconds to wait after the n-th
+		failure of an item before it is queued again.
+	"""
+	queue = Queue.Queue()
+	for item in items:
+		queue.put(item)
+
+	errors = []
+	failures = {}
+	lock = threading.Lock()
+
+	def worker():
+		while not errors:
+			concurrency.acquire()
+			try:
+				item = queue.get_nowait()
+			except Queue.Empty:
+				concurrency.release()
+				return
+			try:
+				size = func(item)
+			except Exception, error:
+				concurrency.release(error=True)
+				with lock:
+					failures[item] = failures.get(item, 0) + 1
+					failed = failures[item]
+					if failed >= attempts or (retryable is not None
+						and not retryable(error)):
+						errors.append(sys.exc_info())
+						return
+				# The slot is free while the item waits, the others go on
+				if delay is not None:
+					time.sleep(delay(failed - 1))
+				queue.put(item)
+				continue
+			concurrency.release(size or 0)
+
+	workers = []
+	for _ in range(max(1, min(concurrency.maximum, queue.qsize()))):
+		thread = threading.Thread(target=worker)
+		thread.daemon = True
+		thread.start()
+		workers.append(thread)
+	for thread in workers:
+		thread.join()
+
+	if errors:
+		raise errors[0][0], errors[0][1], errors[0][2]
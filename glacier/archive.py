@@ -2,21 +2,60 @@
 # Copyright 2012 Paul Engstler
 # See LICENSE for details.
 
-import os, utils, math
+import os, utils, math, hashlib, threading, mmap, multiprocessing, time
+
+def hash_part(task):
+	"""
+		Hashes one part of a file in a worker process and returns the
+		linear hash of the part and its 1 MB leaf digests. The worker
+		opens the file itself, nothing but the results is sent back.
+	"""
+	path, offset, size = task
+	chunk_size = 1024*1024
+	linear = hashlib.sha256()
+	leaves = []
+	with open(path, "rb") as part_file:
+		part_file.seek(offset)
+		while size > 0:
+			data = part_file.read(min(chunk_size, size))
+			if not data:
+				raise IOError("file " + path + " changed while hashing")
+			size -= len(data)
+			linear.update(data)
+			leaves.append(utils.sha256_digest(data))
+	return linear.hexdigest(), leaves
 
 class Archive(object):
 	""" Archive API """
 
-	def __init__(self, inp):
+	def __init__(self, inp, use_mmap=False, hash_processes=None,
+		hash_cache=None, instrumentation=None):
 		"""
             Creates an archive instance
             
             Archives can either represent a local file instance or
 			a remote id. As soon as the archive gets uploaded the 
 			instance will transform.
+
+			A local file can be memory mapped. Its parts are then
+			handed out as buffers pointing into the mapping instead of
+			freshly read strings, no part gets copied in memory.
+
+			Big files can be hashed on several cores, each process
+			hashes whole parts. With a hash cache the hashes of an
+			unchanged file are read from the cache instead.
             
 			:param inp: local file name or archive id
+			:param use_mmap: Memory map the local file (optional)
+			:param hash_processes: Number of processes hashing the file
+			(optional)
+			:param hash_cache: Cache of hashes (optional)
+			:param instrumentation: Receives the hashing throughput,
+			e.g. the instrumentation of the connection (optional)
             :type inp: string
+			:type use_mmap: boolean
+			:type hash_processes: integer
+			:type hash_cache: HashCache
 
 		"""
 
@@ -35,7 +74,12 @@ class Archive(object):
 		# this: "\ ". This doesn't work for Python. Remove each backslash
 		# and you will running again.
 
-		self.partsize = 1024 * 1024 * 64 # 64M parts, because why not
+		# Remote archives keep 64M parts, local files get a part size
+		# fitting their size
+		self.partsize = 1024 * 1024 * 64
+		self.hash_processes = hash_processes
+		self.hash_cache = hash_cache
+		self.instrumentation = instrumentation
 
 		if len(inp) == 138 and not os.path.isfile(inp):
 			self.id = inp
@@ -45,15 +89,31 @@ class Archive(object):
 			except IOError:
 				raise IOError("file " + inp + " does not exist.")
 
+			# Parts may be read from several threads at once, the lock
+			# keeps each seek and its read together
+			self._lock = threading.Lock()
 			self.path = inp
 			self.size = os.fstat(self.file.fileno()).st_size
+			self.partsize = utils.part_size_for(self.size)
 			self.partcount = int(math.ceil(float(self.size)/float(self.partsize)))
+			self.map = None
+			# Empty files can't be mapped, there is nothing to read anyway
+			if use_mmap and self.size:
+				self.map = mmap.mmap(self.file.fileno(), 0,
+					access=mmap.ACCESS_READ)
 			self.hash = None
 			self.treehash = None
+			self.chunk_hashes = None
+			self.part_hashes = None
+			self.part_treehashes = None
 
 	def get_hash(self):
 		if not self._hash:
-			self._hash = utils.sha256(self.file)
+			if self.part_hashes is None:
+				self.calculate_hashes()
+			# A cache entry may lack the linear hash
+			if not self._hash:
+				self.calculate_linear_hash()
 		return self._hash
 
 	def set_hash(self, hashvalue):
@@ -63,7 +123,7 @@ class Archive(object):
 
 	def get_treehash(self):
 		if not self._treehash:
-			self._treehash = self.calculate_tree_hash()
+			self.calculate_hashes()
 		return self._treehash
 
 	def set_treehash(self, hashvalue):
@@ -71,50 +131,240 @@ class Archive(object):
 
 	treehash = property(get_treehash, set_treehash)
 
-	def calculate_tree_hash(self, part=None):
+	def calculate_hashes(self):
 		"""
-		Returns the tree hash of the archive, the entire file
-		if the part number is not given, or just the part if so
+		Reads the file exactly once and fills in every hash an upload
+		needs: the linear SHA256, the 1 MB leaf digests, the tree hash
+		and linear hash of each part and the tree hash of the archive.
 
 		.. note:: only works with a local archive
+		"""
+		started = time.time() if self.instrumentation is not None else None
+		if self.hash_cache is not None and self.hash_cache.restore(self):
+			method = "cache"
+		elif self.parallel_hashing():
+			self.calculate_hashes_parallel()
+			method = "processes"
+		else:
+			self.calculate_hashes_single()
+			method = "single"
+		if started is not None:
+			self.report_hashing(method, started)
 
-		:param part: The part number if hashing just one part
-		:type inp: integer
+	def report_hashing(self, method, started):
+		self.instrumentation.hashing({ "Path":self.path, "Bytes":self.size,
+			"Seconds":time.time() - started, "Method":method })
+
+	def calculate_hashes_single(self):
+		"""
+		Hashes the file in this process, see calculate_hashes
 		"""
 		# This process takes some time for bigger files, please be patient
 		# "The progress bar is moving but the remaining time is going up!"
 		# - CollegeHumor, Matrix runs on WinXP
 
-		chunk_hashes = []
-        
 		chunk_size = 1024*1024 # 1 MB chunks
-		if part != None:
-			chunk_count = int(math.ceil(float(self.part_size(part))/float(chunk_size)))
-			self.file.seek(self.partsize * part)
+		linear = hashlib.sha256()
+		chunk_hashes = []
+		part_hashes = []
+		part_treehashes = []
+
+		# With parts of a power of two number of megabytes, just like
+		# Glacier wants them, the tree hash of the archive is put
+		# together from the tree hashes of the parts. Any other part
+		# size needs a tree hasher of its own for the whole file.
+		chunks = self.partsize / chunk_size
+		aligned = self.partsize % chunk_size == 0 and not chunks & (chunks - 1)
+		whole = None
+		if not aligned:
+			whole = utils.TreeHasher(leaves=chunk_hashes)
+
+		with self._lock:
+			self.file.seek(0)
+			for part in range(self.partcount):
+				part_linear = hashlib.sha256()
+				part_tree = utils.TreeHasher(
+					leaves=chunk_hashes if aligned else None)
+				offset = self.partsize * part
+				remaining = self.part_size(part)
+				while remaining > 0:
+					if self.map is not None:
+						data = buffer(self.map, offset,
+							min(chunk_size, remaining))
+					else:
+						data = self.file.read(min(chunk_size, remaining))
+					if not data:
+						raise IOError("file " + self.path +
+							" changed while hashing")
+					offset += len(data)
+					remaining -= len(data)
+					linear.update(data)
+					part_linear.update(data)
+					part_tree.update(data)
+					if whole is not None:
+						whole.update(data)
+				part_hashes.append(part_linear.hexdigest())
+				part_treehashes.append(part_tree.hexdigest())
+				if aligned and part_tree.partial_leaf() is not None:
+					# Only the last part may end with a shorter chunk
+					chunk_hashes.append(part_tree.partial_leaf())
+
+		if whole is not None:
+			treehash = whole.hexdigest()
+			if whole.partial_leaf() is not None:
+				chunk_hashes.append(whole.partial_leaf())
+		elif part_treehashes:
+			treehash = utils.combine_tree_hashes(part_treehashes)
 		else:
-			chunk_count = int(math.ceil(float(self.size)/float(chunk_size)))
+			# An empty file still has a tree hash, the hash of no data
+			hasher = utils.TreeHasher()
+			chunk_hashes.append(hasher.partial_leaf())
+			treehash = hasher.hexdigest()
+
+		self.chunk_hashes = chunk_hashes
+		self.part_hashes = part_hashes
+		self.part_treehashes = part_treehashes
+		self._hash = linear.hexdigest()
+		self._treehash = treehash
+		if self.hash_cache is not None:
+			self.hash_cache.store(self)
+
+	def parallel_hashing(self):
+		"""
+            Checks whether the hashes are calculated by a process pool,
+			which needs several parts of a whole number of megabytes
+		"""
+		return bool(self.hash_processes) and self.partcount > 1 and \
+			self.partsize % (1024*1024) == 0
+
+	def calculate_hashes_parallel(self):
+		"""
+		Hashes the parts on a pool of ``hash_processes`` processes and
+		fills in the same hashes as calculate_hashes.
+
+		A linear hash can't be split across processes. This process
+		reads the file front to back for it while the pool hashes the
+		parts, hashlib lets go of the interpreter lock while it works.
+
+		.. note:: only works with a local archive
+		"""
+		tasks = [(self.path, self.partsize * part, self.part_size(part))
+			for part in range(self.partcount)]
+		chunk_hashes = []
+		part_hashes = []
+		part_treehashes = []
+
+		pool = multiprocessing.Pool(self.hash_processes)
+		try:
+			# The tasks go out to the pool right away, imap hands the
+			# results back in order of the parts
+			results = pool.imap(hash_part, tasks)
+			self._hash = self.linear_hash()
+			for linear, leaves in results:
+				part_hashes.append(linear)
+				part_treehashes.append(utils.get_tree_hash(leaves))
+				chunk_hashes.extend(leaves)
+		finally:
+			pool.terminate()
+
+		self.chunk_hashes = chunk_hashes
+		self.part_hashes = part_hashes
+		self.part_treehashes = part_treehashes
+		self._treehash = utils.get_tree_hash(chunk_hashes)
+		if self.hash_cache is not None:
+			self.hash_cache.store(self)
+
+	def linear_hash(self):
+		"""
+		Returns the linear SHA256 hash of the whole file, read in 1 MB
+		chunks
+		"""
+		chunk_size = 1024*1024
+		linear = hashlib.sha256()
+		with self._lock:
 			self.file.seek(0)
+			for offset in range(0, self.size, chunk_size):
+				if self.map is not None:
+					data = buffer(self.map, offset, chunk_size)
+				else:
+					data = self.file.read(chunk_size)
+				if not data:
+					raise IOError("file " + self.path +
+						" changed while hashing")
+				linear.update(data)
+		return linear.hexdigest()
+
+	def calculate_linear_hash(self):
+		"""
+		Reads the file to calculate its linear SHA256 hash, for hashes
+		restored from a cache that doesn't know it
+
+		.. note:: only works with a local archive
+		"""
+		started = time.time() if self.instrumentation is not None else None
+		self._hash = self.linear_hash()
+		if started is not None:
+			self.report_hashing("linear", started)
+		if self.hash_cache is not None and self.part_hashes is not None:
+			self.hash_cache.store(self)
+		return self._hash
+
+	def calculate_tree_hash(self, part=None):
+		"""
+		Returns the tree hash of the archive, the entire file
+		if the part number is not given, or just the part if so
 
-		for _ in range(chunk_count):
-			# Read and immediately hash the chunk portion, we just need
-			# 32 bytes stored for each 1 MB chunk. Now that's reducing
-			# the memory footprint!
-			chunk_hashes.append(utils.sha256_digest(self.file.read(chunk_size)))
-    
-		return utils.get_tree_hash(chunk_hashes)
+		.. note:: only works with a local archive
+
+		:param part: The part number if hashing just one part
+		:type inp: integer
+		"""
+		if part != None:
+			if part > self.partcount - 1:
+				raise IndexError("archive does not contain part")
+			if self.part_treehashes is None:
+				self.calculate_hashes()
+			return self.part_treehashes[part]
+		return self.treehash
 	
 	def read_part(self, part):
 		"""
-            Returns the actual bytes of the requested part
+            Returns the actual bytes of the requested part, as a buffer
+			into the mapping if the file is memory mapped
+		"""
+		return self.read(self.partsize * part, self.part_size(part))
+
+	def read(self, offset, size):
 		"""
-		self.file.seek(self.partsize * part)
-		return self.file.read(self.part_size(part))
+            Returns up to size bytes of the file starting at offset, as a
+			buffer into the mapping if the file is memory mapped
+
+			Safe to call from several threads at once.
+		"""
+		if self.map is not None:
+			return buffer(self.map, offset, size)
+		with self._lock:
+			self.file.seek(offset)
+			return self.file.read(size)
+
+	def close(self):
+		"""
+            Closes the local file and its mapping
+		"""
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		self.file.close()
 
 	def part_hash(self, part):
 		"""
-            Returns the sha256 hashof the requested part
+            Returns the sha256 hash of the requested part
 		"""
-		return utils.sha256(self.read_part(part))
+		if part > self.partcount - 1:
+			raise IndexError("archive does not contain part")
+		if self.part_hashes is None:
+			self.calculate_hashes()
+		return self.part_hashes[part]
 
 	def part_size(self, part):
 		"""
@@ -0,0 +1,946 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import errno, json, select, socket, ssl, sys, time, collections, threading
+import Queue, urlparse
+from functools import partial
+import utils
+from request import Request, IDEMPOTENT
+from signer import Signer
+from retry import ResponseError
+
+"""
+
+	Event driven client. A single thread runs an event loop over
+	non-blocking sockets, so thousands of requests can be in flight
+	without a thread for each of them.
+
+	Every call of AsyncVault returns an Operation right away. The loop
+	runs whenever a result is asked for (Operation.result) or when
+	AsyncConnection.run is called, callbacks are called from the loop.
+
+		connection = AsyncConnection(access_key, secret_access_key)
+		vault = connection.get_vault("example")
+		jobs = [vault.describe_job(jid) for jid in job_ids]
+		connection.run()
+		print [job.result()["Completed"] for job in jobs]
+
+	Requests are signed by Request, just like the blocking client. They
+	are signed when a channel takes them, not when they are queued, a
+	request waiting behind thousands of others could otherwise outlive
+	its signature.
+
+"""
+
+# Socket errors that only mean "try again later"
+RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS,
+	errno.EINTR)
+SSL_WANT = (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE)
+
+READ = 1
+WRITE = 4
+
+class Operation(object):
+	""" Result of an asynchronous call, filled in by the event loop """
+
+	def __init__(self, connection):
+		self.connection = connection
+		self._done = False
+		self._result = None
+		self._error = None
+		self._callbacks = []
+
+	def done(self):
+		return self._done
+
+	def result(self):
+		"""
+            Returns the result of the call, running the event loop until
+			it is there. Errors of the call are raised here.
+        """
+		if not self._done:
+			self.connection.run(until=self)
+		if self._error:
+			raise self._error[0], self._error[1], self._error[2]
+		return self._result
+
+	def error(self):
+		"""
+            Returns the exception of a failed call or None
+        """
+		if self._error:
+			return self._error[1]
+		return None
+
+	def add_done_callback(self, callback):
+		"""
+            Calls callback(operation) once the call is done
+        """
+		if self._done:
+			callback(self)
+		else:
+			self._callbacks.append(callback)
+
+	def set_result(self, result):
+		self._result = result
+		self._finish()
+
+	def set_error(self, exc_info):
+		self._error = exc_info
+		self._finish()
+
+	def _finish(self):
+		self._done = True
+		callbacks = self._callbacks
+		self._callbacks = []
+		for callback in callbacks:
+			callback(self)
+
+class AsyncResponse(object):
+	""" Status, headers and (unless streamed) body of a response """
+
+	def __init__(self, status, reason, headers):
+		self.status = status
+		self.reason = reason
+		self.headers = headers
+		self.body = ""
+		self.pieces = []
+
+	def getheader(self, name, default=None):
+		return self.headers.get(name.lower(), default)
+
+	def read(self):
+		return self.body
+
+class Exchange(object):
+	""" One request and its response, handed from channel to channel """
+
+	def __init__(self, req, body, operation, handler, sink):
+		self.req = req
+		self.body = body
+		self.operation = operation
+		self.handler = handler
+		self.sink = sink
+		self.attempts = 0
+
+	def sign(self):
+		"""
+            Dates and signs the request for the attempt about to start
+        """
+		self.req.header["x-amz-date"] = utils.time("%Y%m%dT%H%M%SZ")
+		self.req.header["Authorization"] = \
+			self.req.build_authorization_header()
+
+	def head(self):
+		header = dict(self.req.header)
+		if "content-length" not in [key.lower() for key in header] and \
+			isinstance(self.body, str):
+			# not signed, Glacier wants it for bodiless POSTs as well
+			header["Content-Length"] = str(len(self.body))
+		lines = [self.req.method + " " + self.req.path + " HTTP/1.1"]
+		for key, value in header.items():
+			lines.append(key + ": " + value)
+		return "\r\n".join(lines) + "\r\n\r\n"
+
+	def chunks(self, size=65536):
+		"""
+            Yields the request, head first, in pieces that are sent
+			without copying the body
+        """
+		yield self.head()
+		body = self.body
+		if callable(body):
+			# a factory of chunks, called anew for every attempt
+			body = body()
+		if isinstance(body, (str, buffer, memoryview, bytearray)):
+			for offset in range(0, len(body), size):
+				yield utils.view(body, offset, size)
+		elif body is not None:
+			for chunk in body:
+				yield chunk
+
+	def retryable(self, written=True):
+		"""
+            Checks whether the exchange can be sent again on a new
+			channel, a non-idempotent request only if none of it was
+			written yet
+        """
+		if written and self.req.method not in IDEMPOTENT:
+			return False
+		# an iterator can't be sent twice
+		return self.attempts < 2 and (callable(self.body) or
+			isinstance(self.body, (str, buffer, memoryview, bytearray)))
+
+class Channel(object):
+	"""
+
+		A non-blocking (TLS) connection to one host. Channels are kept
+		alive and reused for the next exchange to the same host.
+
+	"""
+
+	def __init__(self, connection, host, address):
+		"""
+            :param address: Family and address of the socket, as
+			resolved by AsyncConnection.resolve
+        """
+		self.connection = connection
+		self.host = host
+		self.exchange = None
+		self.served = 0
+		self.last_activity = time.time()
+		self._want = WRITE
+		self._out = None
+		self._chunks = None
+		self._in = ""
+		self._response = None
+		self._remaining = None
+		self._written = False
+
+		family, address = address
+		self.sock = socket.socket(family, socket.SOCK_STREAM)
+		self.sock.setblocking(0)
+		result = self.sock.connect_ex(address)
+		if result not in (0,) + RETRY_ERRNOS:
+			raise socket.error(result, "could not connect to " + host)
+		self.state = "connecting"
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def wants(self):
+		return self._want
+
+	def start(self, exchange):
+		exchange.attempts += 1
+		exchange.sign()
+		self.exchange = exchange
+		self._chunks = exchange.chunks()
+		self._written = False
+		self._out = None
+		self._in = ""
+		self._response = None
+		self._remaining = None
+		self.last_activity = time.time()
+		if self.state == "idle":
+			self.state = "sending"
+			self._want = WRITE
+
+	def handle(self, events):
+		"""
+            Called by the loop whenever the socket is ready
+        """
+		self.last_activity = time.time()
+		try:
+			if self.state == "connecting":
+				self._connected()
+			elif self.state == "handshake":
+				self._handshake()
+			elif self.state == "sending":
+				self._send()
+			elif self.state in ("head", "body"):
+				self._receive()
+			elif self.state == "idle":
+				# an idle socket turning readable was closed by the server
+				self.close()
+		except Exception:
+			self.fail(sys.exc_info())
+
+	def _connected(self):
+		error = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+		if error:
+			raise socket.error(error, "could not connect to " + self.host)
+		if self.connection.secure:
+			self.sock = self.connection.wrap_socket(self.sock, self.host)
+			self.state = "handshake"
+			self._handshake()
+		else:
+			self.state = "sending"
+			self._want = WRITE
+
+	def _handshake(self):
+		try:
+			self.sock.do_handshake()
+		except ssl.SSLError, e:
+			if e.args[0] not in SSL_WANT:
+				raise
+			self._want = READ if e.args[0] == ssl.SSL_ERROR_WANT_READ \
+				else WRITE
+			return
+		self.state = "sending"
+		self._want = WRITE
+
+	def _send(self):
+		while True:
+			if self._out is None:
+				try:
+					self._out = self._chunks.next()
+				except StopIteration:
+					self.state = "head"
+					self._want = READ
+					return
+				if not len(self._out):
+					self._out = None
+					continue
+			try:
+				sent = self.sock.send(self._out)
+			except ssl.SSLError, e:
+				if e.args[0] not in SSL_WANT:
+					raise
+				return
+			except socket.error, e:
+				if e.args[0] not in RETRY_ERRNOS:
+					raise
+				return
+			if sent:
+				self._written = True
+			if sent < len(self._out):
+				self._out = utils.view(self._out, sent, len(self._out) - sent)
+				return
+			self._out = None
+
+	def _receive(self):
+		while self.state in ("head", "body"):
+			try:
+				data = self.sock.recv(65536)
+			except ssl.SSLError, e:
+				if e.args[0] not in SSL_WANT:
+					raise
+				return
+			except socket.error, e:
+				if e.args[0] not in RETRY_ERRNOS:
+					raise
+				return
+			if not data:
+				if self.state == "body" and self._remaining is None:
+					# the body was delimited by the end of the connection
+					self._complete(False)
+					return
+				raise socket.error(errno.ECONNRESET,
+					"connection closed by " + self.host)
+			if self.state == "head":
+				self._in += data
+				if "\r\n\r\n" not in self._in:
+					continue
+				head, _, data = self._in.partition("\r\n\r\n")
+				self._in = ""
+				self._parse_head(head)
+			if data:
+				self._body(data)
+			if self.state == "body" and self._remaining == 0:
+				self._complete(True)
+
+	def _parse_head(self, head):
+		lines = head.split("\r\n")
+		version, status, reason = (lines[0].split(" ", 2) + [""])[:3]
+		headers = {}
+		for line in lines[1:]:
+			key, _, value = line.partition(":")
+			headers[key.strip().lower()] = value.strip()
+		self._response = AsyncResponse(int(status), reason, headers)
+		if headers.get("transfer-encoding", "").lower() == "chunked":
+			raise Exception("chunked responses are not supported")
+		if self.exchange.req.method == "HEAD" or self._response.status in \
+			(204, 304) or 100 <= self._response.status < 200:
+			self._remaining = 0
+		elif "content-length" in headers:
+			self._remaining = int(headers["content-length"])
+		else:
+			self._remaining = None
+		self._keep_alive = version == "HTTP/1.1" and \
+			headers.get("connection", "").lower() != "close"
+		self.state = "body"
+
+	def _body(self, data):
+		if self._remaining is not None:
+			data = data[:self._remaining]
+			self._remaining -= len(data)
+		if self.exchange.sink is not None and \
+			200 <= self._response.status < 300:
+			self.exchange.sink(data)
+		else:
+			self._response.pieces.append(data)
+
+	def _complete(self, reusable):
+		exchange = self.exchange
+		response = self._response
+		response.body = "".join(response.pieces)
+		response.pieces = []
+		self.exchange = None
+		self.served += 1
+		if reusable and self._keep_alive:
+			self.state = "idle"
+			self._want = READ
+			self.connection.release(self)
+		else:
+			self.close()
+		# The handler and callbacks run outside of the socket handling,
+		# their errors must not be taken for network errors
+		self.connection.finished.append((exchange, response))
+
+	def fail(self, exc_info):
+		"""
+            Closes the channel and fails or retries its exchange
+        """
+		exchange = self.exchange
+		reused = self.served > 0 and self._response is None
+		self.exchange = None
+		self.close()
+		if exchange is None:
+			return
+		# A kept-alive channel may have been closed by the server just
+		# as we used it, that's worth one more try unless a POST might
+		# have reached it already
+		if reused and exchange.retryable(self._written):
+			self.connection.enqueue(exchange, front=True)
+		else:
+			exchange.operation.set_error(exc_info)
+
+	def close(self):
+		if self.state != "closed":
+			self.connection.forget(self)
+			self.state = "closed"
+			try:
+				self.sock.close()
+			except socket.error:
+				pass
+
+class AsyncConnection(object):
+	""" Event driven Glacier API, see AsyncVault """
+
+	def __init__(self, access_key, secret_access_key, region="us-east-1",
+		max_connections=64, timeout=60, endpoint=None):
+		"""
+            Creates a connection to a Glacier region
+
+			Host names are looked up and archives are hashed on threads
+			of their own, the loop never waits for either.
+
+			:param access_key: Valid and activated access key
+			:param secret_access_key: Matching secret access key
+			:param max_connections: Sockets open at the same time
+			:param timeout: Seconds a socket may stay silent before its
+			request fails
+			:param endpoint: URL of the service, e.g. the one of a
+			glacier.emulator (optional, ``glacier.<region>.amazonaws.com``
+			over HTTPS)
+        """
+		self.access_key = access_key
+		self.secret_access_key = secret_access_key
+		self.region = region
+		self.signer = Signer(access_key, secret_access_key)
+		# Request takes them from every connection, the loop doesn't need
+		# them
+		self.pool = None
+		self.limiter = None
+		self.bandwidth = None
+		self.instrumentation = None
+		self.host = None
+		self.hostname = None
+		self.max_connections = max_connections
+		self.timeout = timeout
+		self.secure = True
+		self.port = 443
+		if endpoint is not None:
+			url = urlparse.urlparse(endpoint)
+			self.host = url.netloc
+			self.hostname = url.hostname
+			self.secure = url.scheme == "https"
+			self.port = url.port or (443 if self.secure else 80)
+		self.ssl_context = None
+		if hasattr(ssl, "create_default_context"):
+			self.ssl_context = ssl.create_default_context()
+		self._queue = collections.deque()
+		self._channels = set()
+		self._idle = {}
+		self.finished = []
+		# Work done off the loop: host name lookups and hashing. Their
+		# results come back as calls run by the loop.
+		self._addresses = {}
+		self._lookup_errors = {}
+		self._resolving = set()
+		self._tasks = Queue.Queue()
+		self._worker = None
+		self._results = collections.deque()
+		self._pending = 0
+
+	def get_vault(self, name):
+		"""
+            Returns an AsyncVault instance
+        """
+		return AsyncVault(name, self)
+
+	def make_request(self, method, path, header={}, signed=[], body=""):
+		"""
+            Returns a signable request, the body only counts for the
+			payload hash if no x-amz-content-sha256 header is given
+        """
+		return Request(	self, self.region, method, path,
+						signed=signed, header=header,
+						body=body)
+
+	def wrap_socket(self, sock, host):
+		if host == self.host and self.hostname:
+			host = self.hostname
+		if self.ssl_context is not None:
+			return self.ssl_context.wrap_socket(sock, server_hostname=host,
+				do_handshake_on_connect=False)
+		return ssl.wrap_socket(sock, do_handshake_on_connect=False)
+
+	def resolve(self, host):
+		"""
+            Returns the family and address of a host, or None while it is
+			looked up on a thread of its own
+
+			A failed lookup is reported once to the exchanges waiting for
+			it, the next exchange looks the host up again.
+        """
+		if host in self._addresses:
+			return self._addresses[host]
+		if host not in self._resolving:
+			self._resolving.add(host)
+			self._pending += 1
+			name = self.hostname if host == self.host and self.hostname \
+				else host
+			def lookup():
+				try:
+					info = socket.getaddrinfo(name, self.port, 0,
+						socket.SOCK_STREAM)
+					result = (info[0][0], info[0][4]), None
+				except Exception:
+					result = None, sys.exc_info()
+				self._results.append(partial(self._resolved, host, *result))
+			thread = threading.Thread(target=lookup)
+			thread.daemon = True
+			thread.start()
+		return None
+
+	def _resolved(self, host, address, error):
+		self._pending -= 1
+		self._resolving.discard(host)
+		if error is None:
+			self._addresses[host] = address
+		else:
+			self._lookup_errors[host] = error
+
+	def background(self, func, operation, then):
+		"""
+            Calls func on the worker thread of the connection, e.g. to
+			hash an archive, and then(result) on the loop. An error of
+			either fails the operation.
+        """
+		self._pending += 1
+		if self._worker is None:
+			self._worker = threading.Thread(target=self._work)
+			self._worker.daemon = True
+			self._worker.start()
+		self._tasks.put((func, operation, then))
+
+	def _work(self):
+		while True:
+			func, operation, then = self._tasks.get()
+			try:
+				result = func()
+			except Exception:
+				self._results.append(partial(self._then, operation, None,
+					sys.exc_info()))
+			else:
+				self._results.append(partial(self._then, operation, then,
+					result))
+
+	def _then(self, operation, then, result):
+		self._pending -= 1
+		if then is None:
+			operation.set_error(result)
+			return
+		try:
+			then(result)
+		except Exception:
+			operation.set_error(sys.exc_info())
+
+	def _collect(self):
+		while self._results:
+			self._results.popleft()()
+
+	def call(self, req, handler, body=None, sink=None, operation=None):
+		"""
+            Queues a request, it is signed once a channel sends it
+
+			:param req: The request
+			:param handler: Called with the AsyncResponse, its return
+			value becomes the result of the operation
+			:param body: Body to send instead of req.body, a string,
+			buffer or a callable returning an iterator of strings
+			:param sink: Called with each piece of a successful response
+			body instead of keeping it (optional)
+			:param operation: Operation to fill in instead of a new one
+			(optional)
+
+			:rtype: Operation
+        """
+		if operation is None:
+			operation = Operation(self)
+		if body is None:
+			body = req.body
+		self.enqueue(Exchange(req, body, operation, handler, sink))
+		return operation
+
+	def enqueue(self, exchange, front=False):
+		if front:
+			self._queue.appendleft(exchange)
+		else:
+			self._queue.append(exchange)
+
+	def release(self, channel):
+		self._idle.setdefault(channel.host, []).append(channel)
+
+	def forget(self, channel):
+		self._channels.discard(channel)
+		idle = self._idle.get(channel.host, [])
+		if channel in idle:
+			idle.remove(channel)
+
+	def _dispatch(self):
+		"""
+            Hands queued exchanges to idle channels or opens new ones
+        """
+		deferred = []
+		while self._queue:
+			exchange = self._queue.popleft()
+			host = exchange.req.host
+			idle = self._idle.get(host)
+			if idle:
+				idle.pop().start(exchange)
+				continue
+			if host in self._lookup_errors:
+				exchange.operation.set_error(self._lookup_errors[host])
+				continue
+			address = self.resolve(host)
+			if address is None:
+				deferred.append(exchange)
+				continue
+			if len(self._channels) >= self.max_connections:
+				# close an idle channel of another host to make room
+				others = [c for h in self._idle for c in self._idle[h]]
+				if not others:
+					deferred.append(exchange)
+					break
+				others[0].close()
+			try:
+				channel = Channel(self, host, address)
+			except Exception:
+				exchange.operation.set_error(sys.exc_info())
+				continue
+			self._channels.add(channel)
+			channel.start(exchange)
+		self._queue.extendleft(reversed(deferred))
+		self._lookup_errors.clear()
+
+	def busy(self):
+		return bool(self._queue) or bool(self._pending) or \
+			any(channel.exchange is not None for channel in self._channels)
+
+	def run(self, until=None):
+		"""
+            Runs the event loop until all operations are done, or until
+			the given operation is done
+        """
+		while True:
+			self._collect()
+			self._dispatch()
+			if until is not None and until.done():
+				return
+			if not self.busy():
+				return
+			# Work off the loop can't wake the poll up, it is checked
+			# every few milliseconds while there is some
+			self._poll(0.005 if self._pending else 1.0)
+			self._expire()
+			self._finish()
+
+	def _finish(self):
+		finished = self.finished
+		self.finished = []
+		for exchange, response in finished:
+			try:
+				result = exchange.handler(response)
+			except Exception:
+				exchange.operation.set_error(sys.exc_info())
+			else:
+				exchange.operation.set_result(result)
+
+	def _poll(self, timeout):
+		channels = dict((channel.fileno(), channel)
+			for channel in list(self._channels))
+		if hasattr(select, "poll"):
+			poller = select.poll()
+			for fd, channel in channels.items():
+				poller.register(fd, channel.wants())
+			events = poller.poll(timeout * 1000)
+		else:
+			readers = [fd for fd, c in channels.items() if c.wants() & READ]
+			writers = [fd for fd, c in channels.items() if c.wants() & WRITE]
+			r, w, _ = select.select(readers, writers, [], timeout)
+			events = [(fd, READ) for fd in r] + [(fd, WRITE) for fd in w]
+		for fd, event in events:
+			channel = channels.get(fd)
+			if channel is not None and channel.state != "closed":
+				channel.handle(event)
+
+	def _expire(self):
+		now = time.time()
+		for channel in list(self._channels):
+			if channel.exchange is not None and \
+				now - channel.last_activity > self.timeout:
+				try:
+					raise socket.timeout("no answer from " + channel.host)
+				except socket.timeout:
+					channel.exchange.attempts = 2
+					channel.fail(sys.exc_info())
+
+	def close(self):
+		"""
+            Closes all channels, unfinished operations are left undone
+        """
+		for channel in list(self._channels):
+			channel.close()
+		self._queue.clear()
+
+def expect(status, message, parse=None):
+	"""
+		Returns a response handler that checks the status and parses
+		the response like the blocking Vault does
+	"""
+	statuses = status if isinstance(status, tuple) else (status,)
+	def handler(resp):
+		if resp.status not in statuses:
+			raise ResponseError(message, resp)
+		if parse is None:
+			return None
+		return parse(resp)
+	return handler
+
+def parse_json(resp):
+	return json.loads(resp.body)
+
+class AsyncVault(object):
+	""" Vault API returning Operations, see glacier.Vault """
+
+	def __init__(self, name, connection):
+		self.connection = connection
+		self.name = name
+		self.region = self.connection.region
+
+	def path(self, *parts):
+		return "/-/vaults/" + self.name + "".join(parts)
+
+	def call(self, method, path, handler, header={}, signed=[], body="",
+		stream=None, sink=None, operation=None):
+		req = self.connection.make_request(method, path, header=header,
+			signed=signed, body=body)
+		return self.connection.call(req, handler, body=stream, sink=sink,
+			operation=operation)
+
+	def describe(self):
+		return self.call("GET", self.path(), expect(200,
+			"could not describe vault", parse_json))
+
+	def upload(self, archive, description=""):
+		"""
+            Uploads an archive, its file is streamed from disk
+
+			The archive is hashed on the worker thread of the connection
+			first, the loop goes on with other requests meanwhile.
+
+			:return: Operation with the archive as result
+        """
+		operation = Operation(self.connection)
+
+		def created(resp):
+			archive.id = resp.getheader("x-amz-archive-id")
+			return archive
+
+		def send(hashes):
+			treehash, linear = hashes
+			header = 	{ 	"Content-Length":str(archive.size),
+							"x-amz-sha256-tree-hash":treehash,
+							"x-amz-content-sha256":linear }
+			if description:
+				header["x-amz-archive-description"] = description
+			self.call("POST", self.path("/archives"), expect(201,
+				"archive could not be created", created), header=header,
+				signed=["x-amz-content-sha256"],
+				stream=lambda: file_chunks(archive, 0, archive.size),
+				operation=operation)
+
+		self.connection.background(lambda: (archive.treehash, archive.hash),
+			operation, send)
+		return operation
+
+	def list_multipart_uploads(self, marker=None, limit=None):
+		path = self.path("/multipart-uploads")
+		query = utils.query_string({ "marker":marker, "limit":limit })
+		if query:
+			path += "?" + query
+		return self.call("GET", path,
+			expect(200, "could not get uploads", parse_json))
+
+	def initiate_multipart_upload(self, archive, description=""):
+		header = 	{ 	"x-amz-part-size":str(archive.partsize),
+						"Content-Length":"0" }
+		if description:
+			header["x-amz-archive-description"] = description
+
+		def initiated(resp):
+			archive.multi_part_id = resp.getheader("x-amz-multipart-upload-id")
+			return archive.multi_part_id
+
+		return self.call("POST", self.path("/multipart-uploads"), expect(201,
+			"archive could not be created", initiated), header=header)
+
+	def upload_part(self, archive, part):
+		"""
+            Uploads a part, it is streamed from disk in small pieces
+
+			The archive is hashed on the worker thread of the connection
+			if it wasn't yet, the loop doesn't wait for that.
+        """
+		operation = Operation(self.connection)
+		offset = archive.partsize * part
+		size = archive.part_size(part)
+
+		def send(hashes):
+			treehash, linear = hashes
+			header = 	{ 	"Content-Length":str(size),
+							"Content-Range":archive.content_range(part),
+							"Content-Type":"application/octet-stream",
+							"x-amz-sha256-tree-hash":treehash,
+							"x-amz-content-sha256":linear }
+			self.call("PUT",
+				self.path("/multipart-uploads/", archive.multi_part_id),
+				expect(204, "error completing multi-part upload process",
+				lambda resp: True), header=header,
+				signed=["x-amz-content-sha256"],
+				stream=lambda: file_chunks(archive, offset, size),
+				operation=operation)
+
+		self.connection.background(lambda: (archive.calculate_tree_hash(part),
+			archive.part_hash(part)), operation, send)
+		return operation
+
+	def list_upload_parts(self, archive, marker=None, limit=None):
+		path = self.path("/multipart-uploads/", archive.multi_part_id)
+		query = utils.query_string({ "marker":marker, "limit":limit })
+		if query:
+			path += "?" + query
+		return self.call("GET", path,
+			expect(200, "could not get uploads", parse_json))
+
+	def complete_multipart_upload(self, archive):
+		header = 	{ 	"x-amz-archive-size":str(archive.size),
+						"x-amz-sha256-tree-hash":archive.treehash }
+
+		def completed(resp):
+			archive.id = resp.getheader("x-amz-archive-id")
+			return archive.id
+
+		return self.call("POST",
+			self.path("/multipart-uploads/", archive.multi_part_id),
+			expect(201, "error completing the multi-part transfer", completed),
+			header=header)
+
+	def abort_multipart_upload(self, archive):
+		return self.call("DELETE",
+			self.path("/multipart-uploads/", archive.multi_part_id),
+			expect(204, "could not delete " + archive.multi_part_id))
+
+	def delete(self, archive):
+		return self.call("DELETE", self.path("/archives/", archive.id),
+			expect(204, "could not delete " + archive.id))
+
+	def set_notifications(self, snstopic, events):
+		config = json.dumps({ "SNSTopic":snstopic, "Events":events })
+		return self.call("PUT", self.path("/notification-configuration"),
+			expect(204, "could not set notifications"),
+			header={ "Content-Length":str(len(config)) }, body=config)
+
+	def get_notifications(self):
+		return self.call("GET", self.path("/notification-configuration"),
+			expect(200, "could not get notifications", parse_json))
+
+	def delete_notifications(self):
+		return self.call("DELETE", self.path("/notification-configuration"),
+			expect(204, "could not delete notifications"))
+
+	def initiate_job(self, jtype, description="", archive=None, snstopic="",
+		inventory_format=None, byte_range=None):
+		if jtype == "archive-retrieval" and not archive:
+			raise Exception("no archive was passed for job type " +
+				"'archive-retrieval'")
+		jobr = { 'Type':jtype }
+		if description:
+			jobr["Description"] = description
+		if snstopic:
+			jobr["SNSTopic"] = snstopic
+		if jtype == "archive-retrieval":
+			jobr["ArchiveId"] = archive.id
+		if inventory_format:
+			jobr["Format"] = inventory_format
+		if byte_range:
+			jobr["RetrievalByteRange"] = byte_range
+		body = json.dumps(jobr)
+		return self.call("POST", self.path("/jobs"), expect(202,
+			"could not initiate job",
+			lambda resp: resp.getheader("x-amz-job-id")),
+			header={ "Content-Length":str(len(body)) }, body=body)
+
+	def describe_job(self, jid):
+		return self.call("GET", self.path("/jobs/", jid),
+			expect(200, "could not describe job", parse_json))
+
+	def get_job_output(self, jid, byte_range="-1", output="json", sink=None):
+		"""
+            Gets the job output
+
+			With a sink the body is passed to sink(data) piece by piece
+			while it arrives and the result is the AsyncResponse.
+        """
+		header = {}
+		if byte_range != "-1":
+			header["Range"] = byte_range
+		if sink is not None:
+			parse = lambda resp: resp
+		elif output == "json":
+			parse = parse_json
+		elif output == "raw":
+			parse = lambda resp: resp.body
+		else:
+			raise Exception("invalid output format", output)
+		return self.call("GET", self.path("/jobs/", jid, "/output"),
+			expect((200, 206), "could not get job output", parse),
+			header=header, sink=sink)
+
+	def list_jobs(self, completed=None, statuscode=None, marker=None,
+		limit=None):
+		if completed is not None:
+			completed = "true" if completed else "false"
+		path = self.path("/jobs")
+		query = utils.query_string({ "completed":completed,
+			"statuscode":statuscode, "marker":marker, "limit":limit })
+		if query:
+			path += "?" + query
+		return self.call("GET", path,
+			expect(200, "could not get list jobs", parse_json))
+
+def file_chunks(archive, offset, size, chunk_size=65536):
+	"""
+		Yields a range of the archive's file in small pieces
+	"""
+	while size > 0:
+		data = archive.read(offset, min(chunk_size, size))
+		if not data:
+			raise IOError("file " + archive.path + " ended early")
+		offset += len(data)
+		size -= len(data)
+		yield data
@@ -0,0 +1,94 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import time, threading
+
+# Bodies are sent and read in pieces of this size while a limit is set
+CHUNK_SIZE = 1024*64
+
+class BandwidthLimiter(object):
+	"""
+
+		Limits the bytes per second of the transfers passing through it.
+
+		A Connection can hold one for all of its transfers and single
+		transfers can get their own on top. Every piece of a body books
+		the time its bytes take at the limited rate, in the order the
+		pieces come in. Transfers sending at the same time therefore
+		take turns piece by piece and share the rate evenly.
+
+		The rate can be changed at any time with set_rate or follow a
+		schedule of times of day, e.g. ``[("08:00", 2*1024*1024),
+		("20:00", None)]`` limits the rate to 2 MB/s during the day
+		and lifts the limit at night.
+
+	"""
+
+	def __init__(self, rate=None, schedule=None):
+		"""
+            :param rate: Bytes per second, None for no limit
+			:param schedule: Times of day (local time, ``HH:MM``) and
+			the rates from then on (optional)
+			:type rate: integer
+			:type schedule: list of tuples
+        """
+		self.rate = rate
+		self.schedule = None
+		if schedule:
+			self.set_schedule(schedule)
+		self.next_free = 0.0
+		self._lock = threading.Lock()
+
+	def set_rate(self, rate):
+		"""
+            Changes the rate, None lifts the limit
+        """
+		with self._lock:
+			self.rate = rate
+			self.schedule = None
+
+	def set_schedule(self, schedule):
+		entries = []
+		for start, rate in schedule:
+			hours, minutes = start.split(":")
+			entries.append((int(hours) * 60 + int(minutes), rate))
+		entries.sort()
+		self.schedule = entries
+
+	def current_rate(self, now=None):
+		"""
+            Returns the rate in force, the one of the last schedule entry
+			that started before now (the day wraps around)
+        """
+		if not self.schedule:
+			return self.rate
+		now = time.localtime(now)
+		minute = now.tm_hour * 60 + now.tm_min
+		rate = self.schedule[-1][1]
+		for start, entry_rate in self.schedule:
+			if start > minute:
+				break
+			rate = entry_rate
+		return rate
+
+	def consume(self, size):
+		"""
+            Waits until ``size`` more bytes may be transferred
+        """
+		with self._lock:
+			rate = self.current_rate()
+			if not rate:
+				return
+			now = time.time()
+			start = max(self.next_free, now)
+			self.next_free = start + size / float(rate)
+		if start > now:
+			time.sleep(start - now)
+
+def throttle(limiters, size):
+	"""
+		Waits until every limiter lets ``size`` bytes pass
+	"""
+	for limiter in limiters:
+		limiter.consume(size)
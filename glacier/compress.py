@@ -0,0 +1,310 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import sys, zlib, struct, bisect, threading, Queue
+from collections import deque
+from stream import read_chunks
+from pack import retrieval_range
+
+"""
+
+	Compressed archives are containers of independently compressed
+	blocks, so that a part of the original data can be restored by
+	retrieving and decompressing only the blocks holding it.
+
+		header	"GLZC", version (1 byte), block size (4 bytes)
+		blocks	zlib streams, or the plain block if it didn't shrink
+		index	per block: method (1 byte), compressed and original
+				length (4 bytes each)
+		footer	original size, offset of the index (8 bytes each),
+				number of blocks (4 bytes), "GLZC"
+
+	All numbers are big endian. The footer has a fixed size, the end of
+	an archive tells where its index is.
+
+"""
+
+MAGIC = "GLZC"
+VERSION = 1
+HEADER = struct.Struct(">4sBI")
+ENTRY = struct.Struct(">BII")
+FOOTER = struct.Struct(">QQI4s")
+
+STORED = 0
+DEFLATED = 1
+
+class Block(object):
+	""" A block of the source, compressed by one of the workers """
+
+	def __init__(self, data):
+		self.data = data
+		self.size = len(data)
+		self.method = None
+		self.error = None
+		self.done = threading.Event()
+
+	def compress(self, level):
+		try:
+			compressed = zlib.compress(self.data, level)
+			# Incompressible blocks, e.g. of media files, are kept as is
+			if len(compressed) < self.size:
+				self.data, self.method = compressed, DEFLATED
+			else:
+				self.method = STORED
+		except Exception:
+			self.error = sys.exc_info()
+		self.done.set()
+
+class BlockIndex(object):
+	"""
+
+		Where every block of a compressed archive is, in the archive and
+		in the original data.
+
+	"""
+
+	def __init__(self, block_size, entries, size):
+		"""
+            :param entries: (method, compressed length, original length)
+			of every block in order
+			:param size: Bytes of the original data
+        """
+		self.block_size = block_size
+		self.entries = entries
+		self.size = size
+		self.blocks = []
+		# Original offsets of the blocks, in order for bisect
+		self.starts = []
+		offset = HEADER.size
+		original = 0
+		for method, length, original_length in entries:
+			self.blocks.append((offset, length, original, original_length,
+				method))
+			self.starts.append(original)
+			offset += length
+			original += original_length
+		self.index_offset = offset
+
+	@property
+	def archive_size(self):
+		return self.index_offset + ENTRY.size * len(self.entries) + \
+			FOOTER.size
+
+	def to_string(self):
+		"""
+            Returns the index and the footer as written to the archive
+        """
+		return "".join([ENTRY.pack(*entry) for entry in self.entries] +
+			[FOOTER.pack(self.size, self.index_offset, len(self.entries),
+				MAGIC)])
+
+	@classmethod
+	def from_tail(cls, tail, archive_size):
+		"""
+            Reads the index from the last bytes of a compressed archive
+
+			If the tail is too short a ValueError tells how many bytes
+			are needed, fetch that many and try again.
+
+			:param tail: The last bytes of the archive
+			:param archive_size: Size of the whole archive
+        """
+		if len(tail) < FOOTER.size:
+			raise ValueError("the index needs the last bytes of the archive",
+				FOOTER.size)
+		size, index_offset, count, magic = FOOTER.unpack(
+			tail[-FOOTER.size:])
+		if magic != MAGIC:
+			raise ValueError("not a compressed archive")
+		needed = archive_size - index_offset
+		if len(tail) < needed:
+			raise ValueError("the index needs the last bytes of the archive",
+				needed)
+		start = len(tail) - needed
+		entries = [ENTRY.unpack_from(tail, start + ENTRY.size * number)
+			for number in range(count)]
+		index = cls(None, entries, size)
+		if index.index_offset != index_offset:
+			raise ValueError("the index doesn't match the archive")
+		return index
+
+	def locate(self, offset, length):
+		"""
+            Returns the blocks holding the given bytes of the original
+			data, (offset in the archive, compressed length, original
+			offset, original length, method) each
+        """
+		end = min(offset + length, self.size)
+		first = max(0, bisect.bisect_right(self.starts, offset) - 1)
+		last = bisect.bisect_left(self.starts, end)
+		return [block for block in self.blocks[first:last]
+			if block[2] + block[3] > offset]
+
+	def retrieval_range(self, offset, length):
+		"""
+            Returns the megabyte aligned range of the archive to retrieve
+			for the given bytes of the original data
+
+			:return: First and last byte of the range
+			:rtype: tuple
+        """
+		blocks = self.locate(offset, length)
+		if not blocks:
+			raise ValueError("range is outside of the original data")
+		first = blocks[0][0]
+		last = blocks[-1][0] + blocks[-1][1]
+		return retrieval_range(first, last - first, self.archive_size)
+
+	def extract(self, data, data_offset, offset, length):
+		"""
+            Returns the given bytes of the original data, decompressed
+			from a retrieved range of the archive
+
+			:param data: Bytes of the archive starting at data_offset,
+			e.g. the output of a job retrieving retrieval_range
+        """
+		pieces = []
+		for position, size, original, _, method in self.locate(offset,
+			length):
+			start = position - data_offset
+			if start < 0 or start + size > len(data):
+				raise ValueError("block at byte %d is not in the data" %
+					position)
+			block = decompress_block(data[start:start+size], method)
+			skip = max(0, offset - original)
+			pieces.append(block[skip:offset + length - original])
+		return "".join(pieces)
+
+def decompress_block(data, method):
+	if method == DEFLATED:
+		return zlib.decompress(data)
+	if method == STORED:
+		return data
+	raise ValueError("unknown compression method %d" % method)
+
+def decompress_file(source, output):
+	"""
+        Writes the original data of a whole compressed archive, e.g. a
+		downloaded job output, into a file-like object
+
+		:param source: The archive, a seekable file-like object
+		:return: Bytes written
+		:rtype: integer
+    """
+	source.seek(0, 2)
+	archive_size = source.tell()
+	source.seek(max(0, archive_size - FOOTER.size))
+	footer = source.read(FOOTER.size)
+	try:
+		index = BlockIndex.from_tail(footer, archive_size)
+	except ValueError, error:
+		if len(error.args) < 2:
+			raise
+		source.seek(archive_size - error.args[1])
+		index = BlockIndex.from_tail(source.read(error.args[1]), archive_size)
+	for position, size, _, _, method in index.blocks:
+		source.seek(position)
+		output.write(decompress_block(source.read(size), method))
+	return index.size
+
+class Compressor(object):
+	"""
+
+		Turns a stream into a compressed archive on the fly.
+
+		The stream is cut into blocks that are compressed on a pool of
+		threads (zlib lets go of the interpreter lock while it works),
+		the compressed blocks come out in their original order. At most
+		two blocks per worker are held in memory at a time.
+
+		Once the output was read to the end ``index`` tells where every
+		block is.
+
+	"""
+
+	def __init__(self, block_size=1024*1024, workers=4, level=6):
+		"""
+            :param block_size: Bytes of the original data per block, the
+			smallest unit a ranged retrieval decompresses
+			:param workers: Number of blocks compressed at the same time
+			:param level: zlib compression level, 1 (fast) to 9 (small)
+        """
+		self.block_size = block_size
+		self.workers = workers
+		self.level = level
+		self.index = None
+
+	def blocks(self, source):
+		"""
+            Yields the source cut into blocks of block_size bytes
+        """
+		pending = []
+		length = 0
+		for data in read_chunks(source, self.block_size):
+			pending.append(data)
+			length += len(data)
+			if length < self.block_size:
+				continue
+			# Joined once, every block is a slice of it
+			joined = "".join(pending)
+			offset = 0
+			while length - offset >= self.block_size:
+				yield joined[offset:offset+self.block_size]
+				offset += self.block_size
+			pending = [joined[offset:]]
+			length -= offset
+		if length:
+			yield "".join(pending)
+
+	def compress(self, source):
+		"""
+            Yields the compressed archive of a stream piece by piece
+
+			:param source: A file-like object or an iterator of strings
+			:rtype: iterator of strings
+        """
+		tasks = Queue.Queue()
+
+		def worker():
+			while True:
+				block = tasks.get()
+				if block is None:
+					return
+				block.compress(self.level)
+
+		threads = []
+		for _ in range(self.workers):
+			thread = threading.Thread(target=worker)
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+
+		entries = []
+		size = 0
+		window = deque()
+		try:
+			yield HEADER.pack(MAGIC, VERSION, self.block_size)
+			for data in self.blocks(source):
+				block = Block(data)
+				window.append(block)
+				tasks.put(block)
+				# The oldest block goes out before more are read
+				if len(window) >= self.workers * 2:
+					yield self.finish(window.popleft(), entries)
+				size += len(data)
+			while window:
+				yield self.finish(window.popleft(), entries)
+		finally:
+			for thread in threads:
+				tasks.put(None)
+
+		self.index = BlockIndex(self.block_size, entries, size)
+		yield self.index.to_string()
+
+	def finish(self, block, entries):
+		block.done.wait()
+		if block.error:
+			raise block.error[0], block.error[1], block.error[2]
+		entries.append((block.method, len(block.data), block.size))
+		return block.data
@@ -0,0 +1,856 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import os, re, sys, csv, ssl, json, time, base64, random, socket, hashlib
+import tempfile, threading, urlparse, Queue, StringIO
+import BaseHTTPServer, SocketServer
+import utils
+from signer import Signer
+from bandwidth import BandwidthLimiter, CHUNK_SIZE
+
+MB = 1024*1024
+
+"""
+
+	A local stand-in for Amazon Glacier, for tests and load tests that
+	shouldn't cost anything.
+
+		python -m glacier.emulator --port 8080 --latency 0.05
+
+	and in Python
+
+		emulator = GlacierEmulator(credentials={ "key":"secret" })
+		emulator.start()
+		connection = Connection("key", "secret",
+			endpoint=emulator.endpoint)
+
+"""
+
+class EmulatorError(Exception):
+	""" An error answer, with the status and code Glacier would send """
+
+	def __init__(self, status, code, message=""):
+		Exception.__init__(self, status, code, message)
+		self.status = status
+		self.code = code
+		self.message = message
+
+def not_found(kind, name):
+	return EmulatorError(404, "ResourceNotFoundException",
+		kind + " not found: " + name)
+
+def invalid(message):
+	return EmulatorError(400, "InvalidParameterValueException", message)
+
+def random_id(length):
+	return base64.urlsafe_b64encode(os.urandom(length))[:length]
+
+def iso_time(timestamp):
+	return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+def tree_hash_aligned(start, end, size):
+	"""
+		Checks whether a range is a subtree of the tree hash of the
+		whole data, only then Glacier tells its tree hash
+	"""
+	length = end - start + 1
+	if start % MB:
+		return False
+	span = MB
+	while span < length:
+		span *= 2
+	return start % span == 0 and (length == span or end == size - 1)
+
+class Body(object):
+	""" A request body, spooled to disk if it is big """
+
+	def __init__(self, directory):
+		self.file = tempfile.SpooledTemporaryFile(MB * 16, dir=directory)
+		self.size = 0
+		self.sha256 = hashlib.sha256()
+		self.tree = utils.TreeHasher()
+
+	def write(self, data):
+		self.file.write(data)
+		self.size += len(data)
+		self.sha256.update(data)
+		self.tree.update(data)
+
+class Stored(object):
+	""" Bytes of an archive or an upload, read by several threads """
+
+	def __init__(self, directory, body=None):
+		self.file = body.file if body else \
+			tempfile.SpooledTemporaryFile(MB * 16, dir=directory)
+		self.lock = threading.Lock()
+
+	def write(self, offset, source, length):
+		with self.lock:
+			source.seek(0)
+			self.file.seek(offset)
+			while length > 0:
+				data = source.read(min(MB, length))
+				self.file.write(data)
+				length -= len(data)
+
+	def read(self, offset, length):
+		with self.lock:
+			self.file.seek(offset)
+			return self.file.read(length)
+
+	def tree_hash(self, offset, length):
+		hasher = utils.TreeHasher()
+		while length > 0:
+			data = self.read(offset, min(MB, length))
+			hasher.update(data)
+			offset += len(data)
+			length -= len(data)
+		return hasher.hexdigest()
+
+class Answer(object):
+	""" Status, headers and body of an answer """
+
+	def __init__(self, status, header=None, body="", stream=None):
+		"""
+            :param stream: Stored bytes sent as the body instead, a
+			tuple (stored, offset, length)
+        """
+		self.status = status
+		self.header = header or {}
+		self.body = body
+		self.stream = stream
+
+def json_answer(status, document, header=None):
+	header = dict(header or {})
+	header["Content-Type"] = "application/json"
+	return Answer(status, header, json.dumps(document))
+
+def page(entries, query, key):
+	"""
+		Cuts a page out of a listing the way Glacier does it, the marker
+		is the position of the first entry of the next page
+	"""
+	start = int(query.get("marker") or 0)
+	limit = int(query.get("limit") or 1000)
+	result = { key:entries[start:start+limit], "Marker":None }
+	if start + limit < len(entries):
+		result["Marker"] = str(start + limit)
+	return result
+
+ROUTES = [(method, re.compile("^/[^/]+/vaults" + pattern + "$"), name)
+	for method, pattern, name in (
+		("GET", "", "list_vaults"),
+		("PUT", "/([^/]+)", "create_vault"),
+		("GET", "/([^/]+)", "describe_vault"),
+		("DELETE", "/([^/]+)", "delete_vault"),
+		("POST", "/([^/]+)/archives", "upload_archive"),
+		("DELETE", "/([^/]+)/archives/([^/]+)", "delete_archive"),
+		("POST", "/([^/]+)/multipart-uploads", "initiate_upload"),
+		("GET", "/([^/]+)/multipart-uploads", "list_uploads"),
+		("PUT", "/([^/]+)/multipart-uploads/([^/]+)", "upload_part"),
+		("GET", "/([^/]+)/multipart-uploads/([^/]+)", "list_parts"),
+		("POST", "/([^/]+)/multipart-uploads/([^/]+)", "complete_upload"),
+		("DELETE", "/([^/]+)/multipart-uploads/([^/]+)", "abort_upload"),
+		("POST", "/([^/]+)/jobs", "initiate_job"),
+		("GET", "/([^/]+)/jobs", "list_jobs"),
+		("GET", "/([^/]+)/jobs/([^/]+)", "describe_job"),
+		("GET", "/([^/]+)/jobs/([^/]+)/output", "job_output"),
+		("PUT", "/([^/]+)/notification-configuration", "set_notifications"),
+		("GET", "/([^/]+)/notification-configuration", "get_notifications"),
+		("DELETE", "/([^/]+)/notification-configuration",
+			"delete_notifications"))]
+
+class GlacierEmulator(object):
+	"""
+
+		Emulates the Glacier API on a local HTTP(S) server, with vaults,
+		archives, multi-part uploads, jobs, ranged job output and
+		notifications kept in memory (big bodies are spooled to disk).
+
+		Requests are checked like Glacier checks them: the SigV4
+		signature (if credentials are given), the payload hash, the tree
+		hashes of archives and parts and the part alignment.
+
+		Faults can be injected to load test clients: a fixed or random
+		latency, a bandwidth cap shared by all requests, throttling
+		answers, server errors and connections reset in the middle of
+		a body. They happen at random at the given rates or can be
+		queued with inject.
+
+		Jobs complete after ``job_delay`` seconds. Their notifications
+		are put into ``notifications`` wrapped like SNS messages, a
+		JobWatcher can use that queue directly.
+
+	"""
+
+	def __init__(self, host="127.0.0.1", port=0, credentials=None,
+		region="us-east-1", latency=0, bandwidth=None, throttle_rate=0,
+		error_rate=0, reset_rate=0, job_delay=0, directory=None,
+		certfile=None, keyfile=None, seed=None):
+		"""
+            :param credentials: Secret key of every access key, None
+			accepts any signature
+			:param latency: Seconds every answer is delayed, or a tuple
+			(lowest, highest) to draw them from
+			:param bandwidth: Bytes per second of all bodies together
+			:param throttle_rate: Share of requests answered with a
+			ThrottlingException
+			:param error_rate: Share of requests answered with a 500
+			:param reset_rate: Share of bodies whose connection is reset
+			half way
+			:param job_delay: Seconds until a job completes
+			:param directory: Where big bodies are spooled to
+			(optional, the temporary directory)
+			:param certfile: Certificate to serve HTTPS with (optional)
+			:param seed: Seed of the random faults (optional)
+			:type credentials: dictionary
+        """
+		self.credentials = credentials
+		self.region = region
+		self.account = "012345678901"
+		self.latency = latency
+		self.bandwidth = BandwidthLimiter(bandwidth) if bandwidth else None
+		self.throttle_rate = throttle_rate
+		self.error_rate = error_rate
+		self.reset_rate = reset_rate
+		self.job_delay = job_delay
+		self.directory = directory
+		self.random = random.Random(seed)
+		self.faults = []
+		self.notifications = Queue.Queue()
+		self.requests = 0
+		self.vaults = {}
+		self._lock = threading.RLock()
+		self._signers = {}
+		self._timers = []
+
+		self.server = EmulatorServer((host, port), EmulatorHandler)
+		self.server.emulator = self
+		self.secure = certfile is not None
+		if self.secure:
+			self.server.socket = ssl.wrap_socket(self.server.socket,
+				keyfile=keyfile, certfile=certfile, server_side=True)
+		self._thread = None
+
+	@property
+	def endpoint(self):
+		host, port = self.server.server_address[:2]
+		return "%s://%s:%d" % ("https" if self.secure else "http", host, port)
+
+	def start(self):
+		"""
+            Serves requests on a thread of its own
+        """
+		self._thread = threading.Thread(target=self.server.serve_forever)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		for timer in self._timers:
+			timer.cancel()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def inject(self, fault, count=1):
+		"""
+            Queues faults for the next requests: ``throttle``, ``error``
+			or ``reset``
+        """
+		with self._lock:
+			self.faults.extend([fault] * count)
+
+	def next_fault(self, with_body):
+		"""
+            Returns the fault of the next request or None
+        """
+		with self._lock:
+			self.requests += 1
+			if self.faults:
+				return self.faults.pop(0)
+			draw = self.random.random()
+		if draw < self.throttle_rate:
+			return "throttle"
+		draw -= self.throttle_rate
+		if draw < self.error_rate:
+			return "error"
+		draw -= self.error_rate
+		if with_body and draw < self.reset_rate:
+			return "reset"
+		return None
+
+	def delay(self):
+		latency = self.latency
+		if isinstance(latency, tuple):
+			latency = self.random.uniform(*latency)
+		if latency:
+			time.sleep(latency)
+
+	# Checks
+
+	def verify_signature(self, method, path, headers, payload_hash):
+		authorization = headers.get("authorization")
+		if not authorization:
+			raise EmulatorError(403, "MissingAuthenticationTokenException",
+				"missing authentication token")
+		match = re.match(r"AWS4-HMAC-SHA256 Credential=([^/]+)/(\d{8})/" +
+			r"([^/]+)/glacier/aws4_request,SignedHeaders=([^,]+)," +
+			r"Signature=([0-9a-f]+)$", authorization)
+		if match is None:
+			raise EmulatorError(400, "IncompleteSignatureException",
+				"malformed authorization header")
+		access_key, datestamp, region, signed, signature = match.groups()
+		if self.credentials is None:
+			return
+		secret = self.credentials.get(access_key)
+		if secret is None:
+			raise EmulatorError(403, "UnrecognizedClientException",
+				"unknown access key " + access_key)
+		signer = self._signers.get(access_key)
+		if signer is None:
+			signer = self._signers[access_key] = Signer(access_key, secret)
+		signed_headers = signed.split(";")
+		header = dict((name, headers.get(name, "")) for name in signed_headers)
+		if "x-amz-date" not in header:
+			header["x-amz-date"] = headers.get("x-amz-date", "")
+		expected = signer.authorization(method, path, header, signed_headers,
+			payload_hash, region)
+		if expected != authorization:
+			raise EmulatorError(403, "InvalidSignatureException",
+				"the request signature does not match")
+
+	def vault(self, name):
+		vault = self.vaults.get(name)
+		if vault is None:
+			raise not_found("vault", name)
+		return vault
+
+	def arn(self, name):
+		return "arn:aws:glacier:%s:%s:vaults/%s" % (self.region,
+			self.account, name)
+
+	def check_hashes(self, headers, body):
+		expected = headers.get("x-amz-sha256-tree-hash")
+		if expected is None:
+			raise invalid("missing x-amz-sha256-tree-hash")
+		if expected != body.tree.hexdigest():
+			raise invalid("tree hash of the body is " +
+				body.tree.hexdigest() + ", not " + expected)
+
+	# Vaults
+
+	def list_vaults(self, request):
+		with self._lock:
+			vaults = [self.describe(name) for name in sorted(self.vaults)]
+		return json_answer(200, page(vaults, request.query, "VaultList"))
+
+	def describe(self, name):
+		vault = self.vault(name)
+		return { "VaultName":name, "VaultARN":self.arn(name),
+			"CreationDate":vault["CreationDate"],
+			"LastInventoryDate":vault["LastInventoryDate"],
+			"NumberOfArchives":len(vault["archives"]),
+			"SizeInBytes":sum(archive["Size"]
+				for archive in vault["archives"].values()) }
+
+	def create_vault(self, request, name):
+		with self._lock:
+			if name not in self.vaults:
+				self.vaults[name] = { "CreationDate":iso_time(time.time()),
+					"LastInventoryDate":None, "archives":{}, "uploads":{},
+					"jobs":{}, "order":[], "notifications":None }
+		return Answer(201, { "Location":"/" + self.account + "/vaults/" +
+			name })
+
+	def describe_vault(self, request, name):
+		with self._lock:
+			return json_answer(200, self.describe(name))
+
+	def delete_vault(self, request, name):
+		with self._lock:
+			if self.vault(name)["archives"]:
+				raise invalid("vault not empty or recently written to")
+			del self.vaults[name]
+		return Answer(204)
+
+	# Archives
+
+	def store_archive(self, name, stored, size, treehash, description):
+		archive_id = random_id(138)
+		with self._lock:
+			vault = self.vault(name)
+			vault["archives"][archive_id] = { "ArchiveId":archive_id,
+				"ArchiveDescription":description,
+				"CreationDate":iso_time(time.time()), "Size":size,
+				"SHA256TreeHash":treehash, "data":stored,
+				"created":time.time() }
+		return Answer(201, { "x-amz-archive-id":archive_id,
+			"x-amz-sha256-tree-hash":treehash,
+			"Location":"/%s/vaults/%s/archives/%s" % (self.account, name,
+				archive_id) })
+
+	def upload_archive(self, request, name):
+		self.vault(name)
+		self.check_hashes(request.headers, request.body)
+		return self.store_archive(name, Stored(self.directory, request.body),
+			request.body.size, request.body.tree.hexdigest(),
+			request.headers.get("x-amz-archive-description", ""))
+
+	def delete_archive(self, request, name, archive_id):
+		with self._lock:
+			archives = self.vault(name)["archives"]
+			if archive_id not in archives:
+				raise not_found("archive", archive_id)
+			del archives[archive_id]
+		return Answer(204)
+
+	# Multi-part uploads
+
+	def upload(self, name, upload_id):
+		upload = self.vault(name)["uploads"].get(upload_id)
+		if upload is None:
+			raise not_found("multipart upload", upload_id)
+		return upload
+
+	def initiate_upload(self, request, name):
+		partsize = int(request.headers.get("x-amz-part-size", 0))
+		chunks = partsize / MB
+		if partsize % MB or not chunks or chunks & (chunks - 1) or \
+			chunks > 4096:
+			raise invalid("invalid part size: " + str(partsize))
+		upload_id = random_id(92)
+		with self._lock:
+			self.vault(name)["uploads"][upload_id] = {
+				"MultipartUploadId":upload_id, "VaultARN":self.arn(name),
+				"ArchiveDescription":
+					request.headers.get("x-amz-archive-description", ""),
+				"PartSizeInBytes":partsize,
+				"CreationDate":iso_time(time.time()),
+				"parts":{}, "data":Stored(self.directory) }
+		return Answer(201, { "x-amz-multipart-upload-id":upload_id,
+			"Location":"/%s/vaults/%s/multipart-uploads/%s" % (self.account,
+				name, upload_id) })
+
+	def list_uploads(self, request, name):
+		with self._lock:
+			uploads = [dict((key, value) for key, value in upload.items()
+					if key not in ("parts", "data"))
+				for upload in sorted(self.vault(name)["uploads"].values(),
+					key=lambda upload: upload["CreationDate"])]
+		return json_answer(200, page(uploads, request.query, "UploadsList"))
+
+	def upload_part(self, request, name, upload_id):
+		with self._lock:
+			upload = self.upload(name, upload_id)
+		self.check_hashes(request.headers, request.body)
+		match = re.match(r"bytes (\d+)-(\d+)/\*$",
+			request.headers.get("content-range", ""))
+		if match is None:
+			raise invalid("invalid content range")
+		start, end = map(int, match.groups())
+		partsize = upload["PartSizeInBytes"]
+		if start % partsize or end - start + 1 != request.body.size or \
+			request.body.size > partsize:
+			raise invalid("content range doesn't fit the part size")
+		upload["data"].write(start, request.body.file, request.body.size)
+		with self._lock:
+			upload["parts"][start] = (end, request.body.tree.hexdigest())
+		return Answer(204, { "x-amz-sha256-tree-hash":
+			request.body.tree.hexdigest() })
+
+	def list_parts(self, request, name, upload_id):
+		with self._lock:
+			upload = self.upload(name, upload_id)
+			parts = [{ "RangeInBytes":"%d-%d" % (start, end),
+					"SHA256TreeHash":treehash }
+				for start, (end, treehash) in sorted(upload["parts"].items())]
+		result = page(parts, request.query, "Parts")
+		for key in ("MultipartUploadId", "VaultARN", "ArchiveDescription",
+			"PartSizeInBytes", "CreationDate"):
+			result[key] = upload[key]
+		return json_answer(200, result)
+
+	def complete_upload(self, request, name, upload_id):
+		with self._lock:
+			upload = self.upload(name, upload_id)
+			parts = sorted(upload["parts"].items())
+		size = int(request.headers.get("x-amz-archive-size", -1))
+		offset = 0
+		for start, (end, _) in parts:
+			if start != offset:
+				raise invalid("part at byte %d is missing" % offset)
+			offset = end + 1
+		if offset != size:
+			raise invalid("the parts hold %d bytes, not %d" % (offset, size))
+		treehash = utils.combine_tree_hashes(
+			[treehash for _, (_, treehash) in parts]) if parts else \
+			utils.TreeHasher().hexdigest()
+		if treehash != request.headers.get("x-amz-sha256-tree-hash"):
+			raise invalid("tree hash of the archive is " + treehash)
+		with self._lock:
+			del self.vault(name)["uploads"][upload_id]
+		return self.store_archive(name, upload["data"], size, treehash,
+			upload["ArchiveDescription"])
+
+	def abort_upload(self, request, name, upload_id):
+		with self._lock:
+			self.upload(name, upload_id)
+			del self.vault(name)["uploads"][upload_id]
+		return Answer(204)
+
+	# Jobs
+
+	def initiate_job(self, request, name):
+		try:
+			params = json.loads(request.body.file.read() if
+				request.body.size else "{}")
+		except ValueError:
+			raise invalid("job parameters are no valid JSON")
+		now = time.time()
+		job_id = random_id(92)
+		job = { "JobId":job_id, "JobDescription":params.get("Description"),
+			"VaultARN":self.arn(name), "CreationDate":iso_time(now),
+			"SNSTopic":params.get("SNSTopic"), "completes":now +
+			self.job_delay }
+		with self._lock:
+			vault = self.vault(name)
+			if params.get("Type") == "archive-retrieval":
+				archive = vault["archives"].get(params.get("ArchiveId"))
+				if archive is None:
+					raise not_found("archive", str(params.get("ArchiveId")))
+				size = archive["Size"]
+				first, last = 0, size - 1
+				if params.get("RetrievalByteRange"):
+					first, last = map(int,
+						params["RetrievalByteRange"].split("-"))
+					if first % MB or (last + 1) % MB and last != size - 1 or \
+						last >= size or first > last:
+						raise invalid("invalid retrieval byte range")
+				treehash = None
+				if tree_hash_aligned(first, last, size):
+					treehash = archive["data"].tree_hash(first,
+						last - first + 1)
+				job.update({ "Action":"ArchiveRetrieval",
+					"ArchiveId":archive["ArchiveId"],
+					"ArchiveSizeInBytes":size,
+					"ArchiveSHA256TreeHash":archive["SHA256TreeHash"],
+					"RetrievalByteRange":"%d-%d" % (first, last),
+					"SHA256TreeHash":treehash,
+					"output":(archive["data"], first, last - first + 1),
+					"content_type":"application/octet-stream" })
+			elif params.get("Type") == "inventory-retrieval":
+				inventory_format = (params.get("Format") or "JSON").upper()
+				output = self.inventory(name, inventory_format)
+				vault["LastInventoryDate"] = iso_time(now)
+				stored = Stored(self.directory)
+				stored.file.write(output)
+				job.update({ "Action":"InventoryRetrieval",
+					"InventorySizeInBytes":len(output),
+					"output":(stored, 0, len(output)),
+					"content_type":"text/csv" if inventory_format == "CSV"
+						else "application/json" })
+			else:
+				raise invalid("invalid job type " + str(params.get("Type")))
+			vault["jobs"][job_id] = job
+			vault["order"].append(job_id)
+
+		timer = threading.Timer(self.job_delay, self.notify, (name, job_id))
+		timer.daemon = True
+		self._timers.append(timer)
+		timer.start()
+		return Answer(202, { "x-amz-job-id":job_id,
+			"Location":"/%s/vaults/%s/jobs/%s" % (self.account, name,
+				job_id) })
+
+	def inventory(self, name, inventory_format):
+		archives = sorted(self.vault(name)["archives"].values(),
+			key=lambda archive: archive["created"])
+		entries = [dict((key, archive[key]) for key in ("ArchiveId",
+				"ArchiveDescription", "CreationDate", "Size",
+				"SHA256TreeHash")) for archive in archives]
+		if inventory_format == "CSV":
+			output = StringIO.StringIO()
+			writer = csv.DictWriter(output, ["ArchiveId",
+				"ArchiveDescription", "CreationDate", "Size",
+				"SHA256TreeHash"])
+			writer.writeheader()
+			writer.writerows(entries)
+			return output.getvalue()
+		return json.dumps({ "VaultARN":self.arn(name),
+			"InventoryDate":iso_time(time.time()), "ArchiveList":entries })
+
+	def job(self, name, job_id):
+		job = self.vault(name)["jobs"].get(job_id)
+		if job is None:
+			raise not_found("job", job_id)
+		return job
+
+	def describe_job_entry(self, job):
+		completed = time.time() >= job["completes"]
+		description = dict((key, value) for key, value in job.items()
+			if key not in ("output", "completes", "content_type"))
+		description.update({ "Completed":completed,
+			"StatusCode":"Succeeded" if completed else "InProgress",
+			"StatusMessage":"Succeeded" if completed else None,
+			"CompletionDate":iso_time(job["completes"]) if completed
+				else None })
+		return description
+
+	def notify(self, name, job_id):
+		with self._lock:
+			vault = self.vaults.get(name)
+			if vault is None or job_id not in vault["jobs"]:
+				return
+			job = self.describe_job_entry(vault["jobs"][job_id])
+			topic = job.get("SNSTopic")
+			config = vault["notifications"]
+			event = job["Action"] + "Completed"
+			if not topic and config and event in config["Events"]:
+				topic = config["SNSTopic"]
+		if topic:
+			self.notifications.put({ "Type":"Notification",
+				"TopicArn":topic, "Message":json.dumps(job) })
+
+	def list_jobs(self, request, name):
+		with self._lock:
+			vault = self.vault(name)
+			jobs = [self.describe_job_entry(vault["jobs"][job_id])
+				for job_id in vault["order"]]
+		completed = request.query.get("completed")
+		if completed is not None:
+			jobs = [job for job in jobs
+				if job["Completed"] == (completed == "true")]
+		if request.query.get("statuscode"):
+			jobs = [job for job in jobs
+				if job["StatusCode"] == request.query["statuscode"]]
+		return json_answer(200, page(jobs, request.query, "JobList"))
+
+	def describe_job(self, request, name, job_id):
+		with self._lock:
+			return json_answer(200,
+				self.describe_job_entry(self.job(name, job_id)))
+
+	def job_output(self, request, name, job_id):
+		with self._lock:
+			job = self.job(name, job_id)
+		if time.time() < job["completes"]:
+			raise invalid("the job is not completed yet")
+		stored, offset, size = job["output"]
+		header = { "Content-Type":job["content_type"] }
+		status = 200
+		first, last = 0, size - 1
+		match = re.match(r"bytes=(\d+)-(\d+)$",
+			request.headers.get("range", ""))
+		if match is not None:
+			first, last = map(int, match.groups())
+			last = min(last, size - 1)
+			if first > last:
+				raise EmulatorError(416, "InvalidRange",
+					"the range is outside of the output")
+			status = 206
+			header["Content-Range"] = "bytes %d-%d/%d" % (first, last, size)
+		if job["Action"] == "ArchiveRetrieval" and \
+			tree_hash_aligned(first, last, size):
+			header["x-amz-sha256-tree-hash"] = stored.tree_hash(
+				offset + first, last - first + 1)
+		return Answer(status, header,
+			stream=(stored, offset + first, last - first + 1))
+
+	# Notifications
+
+	def set_notifications(self, request, name):
+		try:
+			config = json.loads(request.body.file.read())
+		except ValueError:
+			raise invalid("notification configuration is no valid JSON")
+		with self._lock:
+			self.vault(name)["notifications"] = { "SNSTopic":
+				config.get("SNSTopic"), "Events":config.get("Events", []) }
+		return Answer(204)
+
+	def get_notifications(self, request, name):
+		with self._lock:
+			config = self.vault(name)["notifications"]
+		if config is None:
+			raise not_found("notification configuration", name)
+		return json_answer(200, config)
+
+	def delete_notifications(self, request, name):
+		with self._lock:
+			self.vault(name)["notifications"] = None
+		return Answer(204)
+
+class Incoming(object):
+	""" What a handler of the emulator gets to see of a request """
+
+	def __init__(self, headers, query, body):
+		self.headers = headers
+		self.query = query
+		self.body = body
+
+class EmulatorServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def handle_error(self, request, client_address):
+		# Clients going away, e.g. after an injected reset, are expected
+		if not isinstance(sys.exc_info()[1], socket.error):
+			BaseHTTPServer.HTTPServer.handle_error(self, request,
+				client_address)
+
+class EmulatorHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		self.dispatch()
+
+	do_PUT = do_POST = do_DELETE = do_GET
+
+	def log_message(self, *args):
+		pass
+
+	def dispatch(self):
+		emulator = self.server.emulator
+		length = int(self.headers.get("Content-Length") or 0)
+		fault = emulator.next_fault(bool(length) or self.command == "GET")
+
+		if fault == "reset" and (length or self.command != "GET"):
+			# Take half of the body, then drop the connection
+			self.rfile.read(length / 2)
+			self.reset()
+			return
+		body = self.read_body(length, emulator)
+		emulator.delay()
+
+		try:
+			if fault == "throttle":
+				raise EmulatorError(400, "ThrottlingException",
+					"rate of requests exceeded")
+			if fault == "error":
+				raise EmulatorError(500, "ServiceUnavailableException",
+					"injected server error")
+			headers = dict((key.lower(), value)
+				for key, value in self.headers.items())
+			payload_hash = body.sha256.hexdigest()
+			if headers.get("x-amz-content-sha256", payload_hash) != \
+				payload_hash:
+				raise invalid("x-amz-content-sha256 doesn't match the body")
+			emulator.verify_signature(self.command, self.path, headers,
+				payload_hash)
+			url = urlparse.urlparse(self.path)
+			query = dict(urlparse.parse_qsl(url.query))
+			body.file.seek(0)
+			request = Incoming(headers, query, body)
+			answer = self.route(emulator, url.path, request)
+		except EmulatorError, error:
+			answer = json_answer(error.status, { "code":error.code,
+				"message":error.message,
+				"type":"Client" if error.status < 500 else "Server" })
+		except Exception, error:
+			self.server.handle_error(self.request, self.client_address)
+			answer = json_answer(500, { "code":"InternalFailure",
+				"message":str(error), "type":"Server" })
+		self.answer(answer, emulator, fault == "reset")
+
+	def route(self, emulator, path, request):
+		known = False
+		for method, pattern, name in ROUTES:
+			match = pattern.match(path)
+			if match is None:
+				continue
+			known = True
+			if method == self.command:
+				return getattr(emulator, name)(request, *match.groups())
+		if known:
+			raise EmulatorError(405, "MethodNotAllowed",
+				self.command + " is not allowed on " + path)
+		raise EmulatorError(404, "ResourceNotFoundException",
+			"unknown resource " + path)
+
+	def read_body(self, length, emulator):
+		body = Body(emulator.directory)
+		while length > 0:
+			size = min(CHUNK_SIZE, length)
+			if emulator.bandwidth is not None:
+				emulator.bandwidth.consume(size)
+			data = self.rfile.read(size)
+			if not data:
+				break
+			body.write(data)
+			length -= len(data)
+		return body
+
+	def answer(self, answer, emulator, reset):
+		if answer.stream is not None:
+			stored, offset, length = answer.stream
+		else:
+			length = len(answer.body)
+		self.send_response(answer.status)
+		self.send_header("x-amzn-RequestId", random_id(52))
+		self.send_header("Date", self.date_time_string())
+		for key, value in answer.header.items():
+			self.send_header(key, value)
+		self.send_header("Content-Length", str(length))
+		self.end_headers()
+
+		# A reset cuts the body off half way
+		limit = length / 2 if reset else length
+		sent = 0
+		while sent < limit:
+			size = min(CHUNK_SIZE, limit - sent)
+			if emulator.bandwidth is not None:
+				emulator.bandwidth.consume(size)
+			if answer.stream is not None:
+				data = stored.read(offset + sent, size)
+			else:
+				data = answer.body[sent:sent+size]
+			self.wfile.write(data)
+			sent += len(data)
+		if reset:
+			self.reset()
+
+	def reset(self):
+		self.wfile.flush()
+		self.close_connection = 1
+		try:
+			self.connection.shutdown(socket.SHUT_RDWR)
+		except socket.error:
+			pass
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description="local Glacier emulator")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8080)
+	parser.add_argument("--access-key", help="checks signatures with this " +
+		"access key and --secret-key")
+	parser.add_argument("--secret-key")
+	parser.add_argument("--latency", type=float, default=0)
+	parser.add_argument("--bandwidth", type=int, help="bytes per second")
+	parser.add_argument("--throttle-rate", type=float, default=0)
+	parser.add_argument("--error-rate", type=float, default=0)
+	parser.add_argument("--reset-rate", type=float, default=0)
+	parser.add_argument("--job-delay", type=float, default=0)
+	parser.add_argument("--directory")
+	parser.add_argument("--certfile")
+	parser.add_argument("--keyfile")
+	args = parser.parse_args()
+
+	credentials = None
+	if args.access_key:
+		credentials = { args.access_key:args.secret_key }
+	emulator = GlacierEmulator(args.host, args.port, credentials,
+		latency=args.latency, bandwidth=args.bandwidth,
+		throttle_rate=args.throttle_rate, error_rate=args.error_rate,
+		reset_rate=args.reset_rate, job_delay=args.job_delay,
+		directory=args.directory, certfile=args.certfile,
+		keyfile=args.keyfile)
+	print "Glacier emulator listening on " + emulator.endpoint
+	try:
+		emulator.server.serve_forever()
+	except KeyboardInterrupt:
+		emulator.stop()
+
+if __name__ == '__main__':
+	main()
@@ -2,23 +2,66 @@
 # Copyright 2012 Paul Engstler
 # See LICENSE for details.
 
-import json
+import json, utils, httplib, urlparse
 from request import Request
 from vault import Vault
+from pool import ConnectionPool
+from signer import Signer
+from retry import RetryPolicy, TokenBucket, ResponseError
+from paging import paginate
 
 class Connection(object):
 	""" Glacier API """
 
-	def __init__(self, access_key, secret_access_key, region="us-east-1"):
+	def __init__(self, access_key, secret_access_key, region="us-east-1",
+		pool_size=10, idle_timeout=60, index=None, retry=None,
+		rate_limit=None, bandwidth=None, instrumentation=None,
+		endpoint=None):
 		"""
             Creates a connection to a Glacier region
             
 			:param access_key: Valid and activated access key
             :parm secret_access_key: Matching secret access key
+			:param pool_size: Idle keep-alive connections kept per host
+			:param idle_timeout: Seconds an idle connection is kept alive
+			:param index: InventoryIndex kept up to date with the uploads
+			and deletions of all vaults (optional)
+			:param retry: RetryPolicy for part uploads and job output
+			ranges (optional, five attempts)
+			:param rate_limit: Requests per second sent at most
+			(optional, unlimited)
+			:param bandwidth: BandwidthLimiter shared by the bodies of all
+			transfers (optional, unlimited)
+			:param instrumentation: Receives the timings of every request,
+			e.g. a glacier.metrics.Metrics (optional)
+			:param endpoint: URL of the service, e.g. the one of a
+			glacier.emulator (optional, ``glacier.<region>.amazonaws.com``
+			over HTTPS)
         """
 		self.access_key = access_key
 		self.secret_access_key = secret_access_key
 		self.region = region
+		self.pool = ConnectionPool(pool_size, idle_timeout)
+		self.host = None
+		if endpoint is not None:
+			url = urlparse.urlparse(endpoint)
+			self.host = url.netloc
+			if url.scheme == "http":
+				self.pool.connection_class = httplib.HTTPConnection
+		self.signer = Signer(access_key, secret_access_key)
+		self.index = index
+		self.retry = retry if retry is not None else RetryPolicy()
+		self.limiter = None
+		if rate_limit:
+			self.limiter = TokenBucket(rate_limit)
+		self.bandwidth = bandwidth
+		self.instrumentation = instrumentation
+
+	def close(self):
+		"""
+            Closes all idle connections of the pool
+        """
+		self.pool.close()
 
 	def get_vault(self, name):
 		"""
@@ -31,24 +74,50 @@ class Connection(object):
             Requests a list of all vaults and returns all of them as
 			initialized Vault instances.
         """
-		req = self.make_request("GET", "/-/vaults")
-		resp = req.send_request()
+		return list(self.iter_vaults())
 
-		vaults = []
+	def iter_vaults(self, limit=None):
+		"""
+            Yields all vaults as initialized Vault instances, the pages
+			are requested while the vaults are read
+        """
+		for vault in paginate(lambda marker: self.list_vaults(marker, limit),
+			"VaultList"):
+			yield self.get_vault(vault["VaultName"])
 
-		vdata = json.loads(resp.read())
-		for vault in vdata["VaultList"]:
-			vaults.append(self.get_vault(vault["VaultName"]))
+	def list_vaults(self, marker=None, limit=None):
+		"""
+            Lists the vaults, one page at a time
 
-		return vaults
+			:param marker: Marker of the page to list (optional)
+			:param limit: Maximum number of vaults to list (optional)
 
-	def make_request(self, method, path, header={}, signed=[], body=""):
+			:return: Parsed answer from Amazon Glacier
+			:rtype: dictionary
+        """
+		path = "/-/vaults"
+		query = utils.query_string({ "marker":marker, "limit":limit })
+		if query:
+			path += "?" + query
+		req = self.make_request("GET", path)
+		resp = req.send_request()
+
+		if resp.status != 200:
+			raise ResponseError("could not list vaults", resp)
+
+		return json.loads(resp.read())
+
+	def make_request(self, method, path, header={}, signed=[], body="",
+		bandwidth=None):
 		"""
             Returns a ready-to-use request.
+
+			:param bandwidth: BandwidthLimiter of this transfer, on top
+			of the one of the connection (optional)
         """	
 		return Request(	self, self.region, method, path,
 						signed=signed, header=header,
-						body=body)
+						body=body, bandwidth=bandwidth)
 
 	def create_vault(self, name):
 		"""
@@ -0,0 +1,102 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import os, sys, json, base64, tempfile, utils
+
+def unicode_path(path):
+	"""
+		Returns the path as unicode, the way it comes back out of a JSON
+		entry, whether it was given as unicode or as bytes
+	"""
+	if isinstance(path, unicode):
+		return path
+	try:
+		return path.decode(sys.getfilesystemencoding() or "utf-8")
+	except UnicodeDecodeError:
+		# Bytes the file system encoding doesn't know still make a key
+		return path.decode("latin-1")
+
+class HashCache(object):
+	"""
+
+		On-disk cache of archive hashes, so an unchanged file doesn't
+		have to be hashed again.
+
+		Every file gets a small JSON entry in the cache directory. An
+		entry is only used if the path, size, modification time and
+		inode of the file and the part size of the archive are still the
+		same. The leaf digests are stored as one base64 string, 44 bytes
+		per megabyte of file.
+
+	"""
+
+	def __init__(self, directory):
+		"""
+            :param directory: Directory the entries are kept in, it is
+			created if it doesn't exist
+			:type directory: string
+        """
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def key(self, archive):
+		"""
+            Returns the identity of the archive's file
+        """
+		stat = os.fstat(archive.file.fileno())
+		return {	"Path":unicode_path(os.path.abspath(archive.path)),
+					"Size":stat.st_size,
+					"MTime":stat.st_mtime, "Inode":stat.st_ino,
+					"PartSize":archive.partsize }
+
+	def entry_path(self, key):
+		return os.path.join(self.directory,
+			utils.sha256(key["Path"].encode("utf-8")) + ".json")
+
+	def restore(self, archive):
+		"""
+            Fills in the hashes of the archive from its entry
+
+			:return: Whether there was a matching entry
+			:rtype: boolean
+        """
+		key = self.key(archive)
+		try:
+			with open(self.entry_path(key), "r") as entry_file:
+				entry = json.load(entry_file)
+		except (IOError, ValueError):
+			return False
+		if entry.get("Key") != key:
+			return False
+
+		# The hashes end up in headers next to binary bodies, they have
+		# to be plain strings again
+		chunks = base64.b64decode(entry["ChunkHashes"])
+		archive.chunk_hashes = [chunks[i:i+32]
+			for i in range(0, len(chunks), 32)]
+		archive.part_hashes = [str(h) for h in entry["PartHashes"]]
+		archive.part_treehashes = [str(h) for h in entry["PartTreeHashes"]]
+		archive.treehash = str(entry["TreeHash"])
+		if entry["Hash"]:
+			archive.hash = str(entry["Hash"])
+		return True
+
+	def store(self, archive):
+		"""
+            Writes the entry of the archive, replacing the old one
+        """
+		key = self.key(archive)
+		entry = {	"Key":key, "Hash":archive._hash,
+					"TreeHash":archive._treehash,
+					"PartHashes":archive.part_hashes,
+					"PartTreeHashes":archive.part_treehashes,
+					"ChunkHashes":
+						base64.b64encode("".join(archive.chunk_hashes)) }
+
+		# Write to a temporary file first, readers never see half an entry
+		handle, temp = tempfile.mkstemp(dir=self.directory)
+		with os.fdopen(handle, "w") as entry_file:
+			json.dump(entry, entry_file)
+		os.rename(temp, self.entry_path(key))
@@ -0,0 +1,264 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import sqlite3, threading, itertools, utils
+
+class InventoryIndex(object):
+	"""
+
+		Local SQLite index of the archives stored in vaults.
+
+		It is filled from inventory job output and kept up to date by
+		Vault as uploads complete and archives get deleted, so finding
+		an archive by id, tree hash, size or description doesn't need
+		an inventory job of several hours.
+
+	"""
+
+	def __init__(self, path):
+		"""
+            Opens the index, creating it if it doesn't exist
+
+			:param path: Path of the database file, ``:memory:`` keeps
+			it in memory
+			:type path: string
+        """
+		self.path = path
+		# Inventory entries written at once by load_inventory
+		self.batch_size = 1000
+		self._lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.text_factory = str
+		with self._lock:
+			self.db.executescript("""
+				CREATE TABLE IF NOT EXISTS archives (
+					vault TEXT NOT NULL,
+					archive_id TEXT NOT NULL,
+					treehash TEXT,
+					size INTEGER,
+					description TEXT,
+					created TEXT,
+					generation INTEGER DEFAULT 0,
+					PRIMARY KEY (vault, archive_id));
+				CREATE INDEX IF NOT EXISTS archives_treehash
+					ON archives (vault, treehash);
+				CREATE INDEX IF NOT EXISTS archives_size
+					ON archives (vault, size);
+				CREATE INDEX IF NOT EXISTS archives_description
+					ON archives (vault, description);
+			""")
+			self.db.commit()
+
+	def add(self, vault, archive_id, treehash, size, description="",
+		created=None):
+		"""
+            Records an archive, replacing an earlier record of it
+
+			:param vault: Name of the vault
+			:param created: Creation date in ISO 8601 (optional, now)
+        """
+		if created is None:
+			created = utils.time("%Y-%m-%dT%H:%M:%SZ")
+		with self._lock:
+			self.db.execute("INSERT OR REPLACE INTO archives (vault, " +
+				"archive_id, treehash, size, description, created) VALUES " +
+				"(?, ?, ?, ?, ?, ?)",
+				(vault, archive_id, treehash, size, description, created))
+			self.db.commit()
+
+	def remove(self, vault, archive_id):
+		"""
+            Removes the record of an archive
+        """
+		with self._lock:
+			self.db.execute("DELETE FROM archives WHERE vault = ? AND " +
+				"archive_id = ?", (vault, archive_id))
+			self.db.commit()
+
+	def load_inventory(self, vault, reader):
+		"""
+            Loads the entries of an inventory into the index
+
+			Archives created before the inventory that it doesn't list
+			anymore are removed. Newer ones were uploaded after the
+			inventory was taken and are kept.
+
+			:param vault: Name of the vault
+			:param reader: The entries of the inventory, e.g. an
+			InventoryReader or Vault.iter_inventory
+			:return: Number of entries loaded
+			:rtype: integer
+        """
+		rows = ((vault, entry["ArchiveId"], entry.get("SHA256TreeHash"),
+			entry.get("Size"), entry.get("ArchiveDescription", ""),
+			entry.get("CreationDate")) for entry in reader)
+		with self._lock:
+			generation = self.db.execute("SELECT COALESCE(MAX(generation), " +
+				"0) + 1 FROM archives WHERE vault = ?", (vault,)).fetchone()[0]
+
+		# The entries arrive while the inventory is downloaded, the lock
+		# is only held while a batch is written so that uploads and
+		# deletes can update the index in the meantime
+		count = 0
+		while True:
+			batch = list(itertools.islice(rows, self.batch_size))
+			if not batch:
+				break
+			with self._lock:
+				self.db.executemany("INSERT OR REPLACE INTO archives " +
+					"(vault, archive_id, treehash, size, description, " +
+					"created, generation) VALUES (?, ?, ?, ?, ?, ?, %d)" %
+					generation, batch)
+				self.db.commit()
+			count += len(batch)
+
+		inventory_date = getattr(reader, "header", {}).get("InventoryDate")
+		if inventory_date:
+			with self._lock:
+				self.db.execute("DELETE FROM archives WHERE vault = ? AND " +
+					"generation < ? AND created < ?",
+					(vault, generation, str(inventory_date)))
+				self.db.commit()
+		return count
+
+	def find(self, vault, archive_id=None, treehash=None, size=None,
+		description=None):
+		"""
+            Returns the archives of the vault matching all given fields
+
+			:rtype: list of dictionaries
+        """
+		where = ["vault = ?"]
+		values = [vault]
+		for column, value in (("archive_id", archive_id),
+			("treehash", treehash), ("size", size),
+			("description", description)):
+			if value is not None:
+				where.append(column + " = ?")
+				values.append(value)
+		with self._lock:
+			rows = self.db.execute("SELECT archive_id, treehash, size, " +
+				"description, created FROM archives WHERE " +
+				" AND ".join(where) + " ORDER BY created", values).fetchall()
+		return [{	"ArchiveId":row[0], "SHA256TreeHash":row[1], "Size":row[2],
+					"ArchiveDescription":row[3], "CreationDate":row[4] }
+				for row in rows]
+
+	def lookup(self, vault, treehash, size):
+		"""
+            Returns the id of an archive with this content or None
+        """
+		found = self.find(vault, treehash=treehash, size=size)
+		if found:
+			return found[0]["ArchiveId"]
+		return None
+
+	def close(self):
+		with self._lock:
+			self.db.close()
+
+class PackIndex(object):
+	"""
+
+		Local SQLite index of the files stored in pack archives.
+
+		Every file is recorded with the pack archive holding it, its
+		offset and length in there and its tree hash, so a restore only
+		has to retrieve the range of the pack the file lies in.
+
+	"""
+
+	def __init__(self, path):
+		"""
+            Opens the index, creating it if it doesn't exist
+
+			:param path: Path of the database file, ``:memory:`` keeps
+			it in memory
+			:type path: string
+        """
+		self.path = path
+		self._lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.text_factory = str
+		with self._lock:
+			self.db.executescript("""
+				CREATE TABLE IF NOT EXISTS packs (
+					vault TEXT NOT NULL,
+					archive_id TEXT NOT NULL,
+					size INTEGER,
+					treehash TEXT,
+					PRIMARY KEY (vault, archive_id));
+				CREATE TABLE IF NOT EXISTS files (
+					vault TEXT NOT NULL,
+					path TEXT NOT NULL,
+					archive_id TEXT NOT NULL,
+					offset INTEGER,
+					length INTEGER,
+					treehash TEXT,
+					PRIMARY KEY (vault, path));
+				CREATE INDEX IF NOT EXISTS files_archive
+					ON files (vault, archive_id);
+			""")
+			self.db.commit()
+
+	def add_pack(self, vault, archive_id, size, treehash, files):
+		"""
+            Records a stored pack and the files in it
+
+			:param vault: Name of the vault
+			:param files: Path, offset, length and tree hash of every
+			file in the pack
+			:type files: list of tuples
+        """
+		with self._lock:
+			self.db.execute("INSERT OR REPLACE INTO packs (vault, archive_id, " +
+				"size, treehash) VALUES (?, ?, ?, ?)",
+				(vault, archive_id, size, treehash))
+			self.db.executemany("INSERT OR REPLACE INTO files (vault, path, " +
+				"archive_id, offset, length, treehash) VALUES " +
+				"(?, ?, ?, ?, ?, ?)", ((vault, path, archive_id, offset,
+				length, filehash) for path, offset, length, filehash in files))
+			self.db.commit()
+
+	def remove_pack(self, vault, archive_id):
+		"""
+            Removes the record of a pack and of the files in it
+        """
+		with self._lock:
+			self.db.execute("DELETE FROM files WHERE vault = ? AND " +
+				"archive_id = ?", (vault, archive_id))
+			self.db.execute("DELETE FROM packs WHERE vault = ? AND " +
+				"archive_id = ?", (vault, archive_id))
+			self.db.commit()
+
+	def locate(self, vault, path):
+		"""
+            Returns where a file is stored or None
+
+			:rtype: dictionary
+        """
+		with self._lock:
+			row = self.db.execute("SELECT files.archive_id, offset, length, " +
+				"files.treehash, packs.size FROM files JOIN packs ON " +
+				"packs.vault = files.vault AND " +
+				"packs.archive_id = files.archive_id " +
+				"WHERE files.vault = ? AND path = ?", (vault, path)).fetchone()
+		if row is None:
+			return None
+		return {	"Path":path, "ArchiveId":row[0], "Offset":row[1],
+					"Length":row[2], "SHA256TreeHash":row[3], "PackSize":row[4] }
+
+	def files(self, vault, archive_id):
+		"""
+            Returns the paths of the files in a pack ordered by offset
+        """
+		with self._lock:
+			rows = self.db.execute("SELECT path FROM files WHERE vault = ? " +
+				"AND archive_id = ? ORDER BY offset",
+				(vault, archive_id)).fetchall()
+		return [row[0] for row in rows]
+
+	def close(self):
+		with self._lock:
+			self.db.close()
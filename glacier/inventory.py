@@ -0,0 +1,147 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import csv, json, re
+
+# Only these characters change the state of the JSON scanner, keys and
+# values are told apart at the top level only
+SPECIAL = re.compile(r'["{}\[\]]')
+TOP_LEVEL = re.compile(r'["{}\[\]:,]')
+STRING = re.compile(r'[\\"]')
+
+class InventoryReader(object):
+	"""
+
+		Reads the output of an inventory-retrieval job while it arrives
+		and yields the entries of its ArchiveList one at a time.
+
+		Only the entry being read is kept in memory, so the memory use
+		doesn't grow with the size of the vault. The other fields of the
+		inventory (VaultARN, InventoryDate) are found in ``header`` once
+		they have been read.
+
+		Both the JSON and the CSV format are understood. The sizes of
+		CSV entries are converted to integers, just like in JSON.
+
+	"""
+
+	def __init__(self, stream, format="json", chunk_size=1024*64):
+		"""
+            :param stream: Object with a read(size) method, e.g. the
+			response of Vault.job_output_response
+			:param format: ``json`` or ``csv``
+        """
+		if format not in ("json", "csv"):
+			raise Exception("invalid inventory format", format)
+		self.stream = stream
+		self.format = format
+		self.chunk_size = chunk_size
+		self.header = {}
+
+	def __iter__(self):
+		if self.format == "csv":
+			return self.csv_entries()
+		return self.json_entries()
+
+	def chunks(self):
+		while True:
+			data = self.stream.read(self.chunk_size)
+			if not data:
+				return
+			yield data
+
+	def lines(self):
+		rest = ""
+		for data in self.chunks():
+			lines = (rest + data).split("\n")
+			rest = lines.pop()
+			for line in lines:
+				yield line + "\n"
+		if rest:
+			yield rest
+
+	def csv_entries(self):
+		for entry in csv.DictReader(self.lines()):
+			if entry.get("Size"):
+				entry["Size"] = int(entry["Size"])
+			yield entry
+
+	def json_entries(self):
+		depth = 0
+		in_string = False
+		in_list = False
+		escape_pending = False
+		expect_key = True
+		key = None
+		# Raw text of the top level string or the list entry being read
+		capturing = False
+		text = []
+		for data in self.chunks():
+			pos = 0
+			if escape_pending:
+				# the backslash ended the last chunk
+				pos = 1
+				escape_pending = False
+			start = 0 if capturing else None
+			while True:
+				if in_string:
+					match = STRING.search(data, pos)
+				elif depth == 1:
+					match = TOP_LEVEL.search(data, pos)
+				else:
+					match = SPECIAL.search(data, pos)
+				if match is None:
+					break
+				char = match.group()
+				pos = match.end()
+
+				if in_string:
+					if char == "\\":
+						if pos < len(data):
+							pos += 1
+						else:
+							escape_pending = True
+					else:
+						in_string = False
+						if depth == 1:
+							text.append(data[start:pos-1])
+							value = json.loads('"' + "".join(text) + '"')
+							text = []
+							capturing = False
+							start = None
+							if expect_key:
+								key = value
+							else:
+								self.header[key] = value
+					continue
+
+				if char == '"':
+					in_string = True
+					if depth == 1:
+						capturing = True
+						start = pos
+				elif char == ":":
+					expect_key = False
+				elif char == ",":
+					expect_key = True
+				elif char in "{[":
+					depth += 1
+					if depth == 2 and char == "[" and key == "ArchiveList":
+						in_list = True
+					elif depth == 3 and char == "{" and in_list:
+						capturing = True
+						start = pos - 1
+				else:
+					depth -= 1
+					if depth == 2 and char == "}" and in_list:
+						text.append(data[start:pos])
+						entry = "".join(text)
+						text = []
+						capturing = False
+						start = None
+						yield json.loads(entry)
+					elif depth == 1 and char == "]":
+						in_list = False
+			if capturing:
+				text.append(data[start:])
@@ -0,0 +1,90 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import os, json, threading
+
+class UploadJournal(object):
+	"""
+
+		Local record of a multi-part upload, so that it can be resumed
+		after a crash without sending the stored parts again.
+
+		The journal is a text file with a JSON object describing the
+		upload: id, archive size, part size and the tree hash of every
+		part. It is written once when the upload starts. Which parts are
+		stored is asked from Glacier (list_upload_parts) when resuming,
+		the parts it lists are checked against the tree hashes of the
+		journal. Nothing is written per part, the upload threads never
+		wait for the disk.
+
+	"""
+
+	def __init__(self, path):
+		"""
+            Opens the journal, reading it if the file exists
+
+			:param path: Path of the journal file
+			:type path: string
+        """
+		self.path = path
+		self.upload_id = None
+		self.size = None
+		self.partsize = None
+		self.treehash = None
+		self.part_treehashes = []
+		self._lock = threading.Lock()
+		if os.path.isfile(path):
+			self.load()
+
+	def load(self):
+		with open(self.path, "r") as journal:
+			# Journals of earlier versions have a line per stored part
+			# after the upload, they aren't needed
+			line = journal.readline()
+		if not line:
+			return
+		upload = json.loads(line)
+		self.upload_id = upload["UploadId"]
+		self.size = upload["Size"]
+		self.partsize = upload["PartSize"]
+		self.treehash = upload["TreeHash"]
+		self.part_treehashes = upload["PartTreeHashes"]
+
+	def start(self, archive):
+		"""
+            Starts a new journal for the multi-part upload of the archive,
+			archive.multi_part_id has to be set already
+        """
+		self.upload_id = archive.multi_part_id
+		self.size = archive.size
+		self.partsize = archive.partsize
+		self.treehash = archive.treehash
+		self.part_treehashes = [archive.calculate_tree_hash(part)
+			for part in range(archive.partcount)]
+		upload = {	"UploadId":self.upload_id, "Size":self.size,
+					"PartSize":self.partsize, "TreeHash":self.treehash,
+					"PartTreeHashes":self.part_treehashes }
+		with self._lock:
+			with open(self.path, "w") as journal:
+				journal.write(json.dumps(upload) + "\n")
+				journal.flush()
+				os.fsync(journal.fileno())
+
+	def matches(self, archive):
+		"""
+            Checks whether the journal belongs to an upload of this very
+			archive, with the same content and part size
+        """
+		return self.upload_id is not None and \
+			self.size == archive.size and \
+			self.partsize == archive.partsize and \
+			self.treehash == archive.treehash
+
+	def remove(self):
+		"""
+            Deletes the journal once the upload is completed
+        """
+		if os.path.isfile(self.path):
+			os.remove(self.path)
+		self.upload_id = None
@@ -0,0 +1,183 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import os, json, bisect, tempfile, threading
+
+# Upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+	10.0, 30.0, 60.0)
+# Upper bounds of the hashing throughput buckets in MB per second
+THROUGHPUT_BUCKETS = (10, 25, 50, 100, 200, 400, 800, 1600)
+
+# Phases of a request in the order they happen
+PHASES = ("Connect", "Sign", "Send", "FirstByte")
+
+class Instrumentation(object):
+	"""
+
+		Receives the events of a Connection and its archives. Subclasses
+		override the events they are interested in.
+
+		A request event is a dictionary with Method, Path, Status (None
+		if the request failed), Error, BytesSent, BytesReceived (the
+		announced length of the answer), Reused (whether a kept-alive
+		connection was used) and the seconds of the phases Connect, Sign,
+		Send and FirstByte.
+
+		A hashing event is a dictionary with Path, Bytes, Seconds and
+		Method (``single``, ``processes``, ``cache`` or ``linear``).
+
+		Events are reported from the thread doing the work, handlers of
+		several threads have to take care of locking.
+
+	"""
+
+	def request(self, event):
+		pass
+
+	def hashing(self, event):
+		pass
+
+class Histogram(object):
+	""" Counts observations per bucket, Prometheus style """
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def cumulative(self):
+		"""
+            Returns (upper bound, observations up to it) per bucket
+        """
+		total = 0
+		result = []
+		for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+			total += count
+			result.append((bound, total))
+		return result
+
+class Metrics(Instrumentation):
+	"""
+
+		Aggregates the events into counters and histograms kept in
+		memory. They can be dumped as JSON or in the text format of
+		Prometheus, e.g. into a file read by the textfile collector of
+		the node exporter.
+
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.counters = {}
+		self.histograms = {}
+
+	def count(self, name, labels, value=1):
+		key = (name, tuple(sorted(labels.items())))
+		self.counters[key] = self.counters.get(key, 0) + value
+
+	def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+		key = (name, tuple(sorted(labels.items())))
+		histogram = self.histograms.get(key)
+		if histogram is None:
+			histogram = self.histograms[key] = Histogram(buckets)
+		histogram.observe(value)
+
+	def request(self, event):
+		labels = { "method":event["Method"],
+			"status":str(event["Status"] or "error") }
+		with self._lock:
+			self.count("glacier_requests_total", labels)
+			self.count("glacier_sent_bytes_total",
+				{ "method":event["Method"] }, event["BytesSent"])
+			self.count("glacier_received_bytes_total",
+				{ "method":event["Method"] }, event["BytesReceived"] or 0)
+			if event["Reused"]:
+				self.count("glacier_reused_connections_total", {})
+			for phase in PHASES:
+				if event.get(phase) is not None:
+					self.observe("glacier_request_seconds",
+						{ "phase":phase.lower() }, event[phase])
+
+	def hashing(self, event):
+		labels = { "method":event["Method"] }
+		with self._lock:
+			self.count("glacier_hashed_bytes_total", labels, event["Bytes"])
+			self.count("glacier_hash_seconds_total", labels, event["Seconds"])
+			if event["Seconds"] > 0:
+				self.observe("glacier_hash_megabytes_per_second", labels,
+					event["Bytes"] / 1048576.0 / event["Seconds"],
+					THROUGHPUT_BUCKETS)
+
+	def to_json(self):
+		"""
+            Returns the counters and histograms as a JSON string
+        """
+		with self._lock:
+			counters = [{ "Name":name, "Labels":dict(labels), "Value":value }
+				for (name, labels), value in sorted(self.counters.items())]
+			histograms = [{ "Name":name, "Labels":dict(labels),
+					"Buckets":[[bound if bound != float("inf") else "+Inf",
+						count] for bound, count in histogram.cumulative()],
+					"Sum":histogram.sum, "Count":histogram.count }
+				for (name, labels), histogram in
+					sorted(self.histograms.items())]
+		return json.dumps({ "Counters":counters, "Histograms":histograms })
+
+	def to_prometheus(self):
+		"""
+            Returns the counters and histograms in the Prometheus text
+			exposition format
+        """
+		lines = []
+		typed = set()
+		def declare(name, kind):
+			if name not in typed:
+				typed.add(name)
+				lines.append("# TYPE %s %s" % (name, kind))
+		with self._lock:
+			for (name, labels), value in sorted(self.counters.items()):
+				declare(name, "counter")
+				lines.append("%s%s %s" % (name, label_text(labels), value))
+			for (name, labels), histogram in sorted(self.histograms.items()):
+				declare(name, "histogram")
+				for bound, count in histogram.cumulative():
+					le = "+Inf" if bound == float("inf") else repr(bound)
+					lines.append("%s_bucket%s %d" % (name,
+						label_text(labels + (("le", le),)), count))
+				lines.append("%s_sum%s %s" % (name, label_text(labels),
+					repr(histogram.sum)))
+				lines.append("%s_count%s %d" % (name, label_text(labels),
+					histogram.count))
+		return "\n".join(lines) + "\n"
+
+	def write(self, path, format="prometheus"):
+		"""
+            Writes the metrics to a file, replacing it at once so readers
+			never see half of it
+
+			:param format: ``prometheus`` or ``json``
+        """
+		if format == "json":
+			text = self.to_json()
+		elif format == "prometheus":
+			text = self.to_prometheus()
+		else:
+			raise Exception("invalid metrics format", format)
+		handle, temp = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+		with os.fdopen(handle, "w") as output:
+			output.write(text)
+		os.rename(temp, path)
+
+def label_text(labels):
+	if not labels:
+		return ""
+	return "{" + ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\")
+		.replace('"', '\\"')) for key, value in labels) + "}"
@@ -0,0 +1,219 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import os, sys, tempfile, utils
+from archive import Archive
+from retry import TransferError
+
+MB = 1024 * 1024
+
+def retrieval_range(offset, length, pack_size):
+	"""
+        Returns the megabyte aligned range of a pack holding the given
+		bytes, Glacier only retrieves ranges starting and ending at a
+		megabyte boundary or at the end of the archive
+
+		:return: First and last byte of the range
+		:rtype: tuple
+    """
+	first = offset - offset % MB
+	last = min((offset + length + MB - 1) / MB * MB, pack_size) - 1
+	return first, last
+
+class Packer(object):
+	"""
+
+		Packs many small files into big archives.
+
+		Every file costs a signed request and some storage overhead in
+		Glacier, backing up small files one archive each is slow and
+		expensive. The packer appends the files to a pack file instead,
+		uploads it as one archive with Vault.upload_multipart once it
+		reached ``pack_size`` and records every file in a PackIndex.
+
+		A single file can be restored later by retrieving only the
+		megabyte aligned range of the pack it lies in.
+
+	"""
+
+	def __init__(self, vault, index, pack_size=1024*MB, directory=None,
+		concurrency=4):
+		"""
+            :param vault: Vault the packs are uploaded to
+			:param index: Index the files are recorded in
+			:param pack_size: Size a pack is uploaded at
+			:param directory: Directory the pack is written to before it
+			is uploaded (optional, the temporary directory)
+			:param concurrency: Number of parts uploaded at the same time
+			:type vault: Vault
+			:type index: PackIndex
+        """
+		self.vault = vault
+		self.index = index
+		self.pack_size = pack_size
+		self.directory = directory
+		self.concurrency = concurrency
+		self.pack = None
+		self.pack_path = None
+		self.offset = 0
+		self.entries = []
+
+	def add(self, path, name=None):
+		"""
+            Appends a file to the current pack
+
+			The pack is uploaded before the file if the file doesn't fit
+			in anymore and after it if the pack is full. If that upload
+			fails the error is raised and the pack is kept, with the new
+			file only if it was already appended. The next flush sends
+			it again. A file that can't be read is left out of the pack.
+
+			:param path: Path of the file
+			:param name: Name the file is recorded with (optional, path)
+			:return: Offset of the file in its pack
+			:rtype: integer
+        """
+		if name is None:
+			name = path
+		with open(path, "rb") as source:
+			size = os.fstat(source.fileno()).st_size
+			if self.entries and self.offset + size > self.pack_size:
+				self.flush()
+			if self.pack is None:
+				handle, self.pack_path = tempfile.mkstemp(dir=self.directory)
+				self.pack = os.fdopen(handle, "wb")
+				self.offset = 0
+
+			# Copy in 1 MB chunks and tree hash the file on the way
+			hasher = utils.TreeHasher()
+			try:
+				while True:
+					data = source.read(MB)
+					if not data:
+						break
+					self.pack.write(data)
+					hasher.update(data)
+			except:
+				# What was copied would shift the files after it
+				error = sys.exc_info()
+				self.pack.seek(self.offset)
+				self.pack.truncate()
+				raise error[0], error[1], error[2]
+
+		offset = self.offset
+		self.offset += hasher.size
+		self.entries.append((name, offset, hasher.size, hasher.hexdigest()))
+		if self.offset >= self.pack_size:
+			self.flush()
+		return offset
+
+	def flush(self):
+		"""
+            Uploads the current pack and records its files
+
+			The pack file and its files are only dropped once the pack
+			is recorded in the index. If anything fails before that the
+			error is raised and flush can be called again.
+
+			:return: Id of the pack archive or None if it was empty
+			:rtype: string
+        """
+		if self.pack is None:
+			return None
+		# Written out but kept open, more files may still be added if
+		# the upload fails
+		self.pack.flush()
+		archive = Archive(self.pack_path,
+			instrumentation=self.vault.connection.instrumentation)
+		try:
+			description = "pack of %d files" % len(self.entries)
+			try:
+				self.vault.upload_multipart(archive, self.concurrency,
+					description)
+			except:
+				error = sys.exc_info()
+				# The next flush starts a new upload
+				if getattr(archive, "multi_part_id", None) is not None:
+					try:
+						self.vault.abort_multipart_upload(archive)
+					except Exception:
+						pass
+				raise error[0], error[1], error[2]
+			self.index.add_pack(self.vault.name, archive.id, archive.size,
+				archive.treehash, self.entries)
+		finally:
+			archive.close()
+
+		self.pack.close()
+		os.remove(self.pack_path)
+		self.pack = None
+		self.pack_path = None
+		self.entries = []
+		return archive.id
+
+	def close(self):
+		"""
+            Uploads the files that were added since the last pack
+        """
+		return self.flush()
+
+	def request_restore(self, name, description="", snstopic=""):
+		"""
+            Initiates the retrieval of the range of the pack holding a file
+
+			:param name: Name the file was recorded with
+			:return: job id, None for empty files which need no job
+			:rtype: string
+        """
+		entry = self.locate(name)
+		if not entry["Length"]:
+			return None
+		first, last = retrieval_range(entry["Offset"], entry["Length"],
+			entry["PackSize"])
+		return self.vault.initiate_job("archive-retrieval", description,
+			Archive(entry["ArchiveId"]), snstopic,
+			byte_range="%d-%d" % (first, last))
+
+	def restore(self, name, jid, path):
+		"""
+            Writes a file out of the output of a job started with
+			request_restore, only its own bytes are downloaded
+
+			:param name: Name the file was recorded with
+			:param jid: The job id
+			:param path: File the content is written to
+			:return: Tree hash of the restored file
+			:rtype: string
+        """
+		entry = self.locate(name)
+		first, _ = retrieval_range(entry["Offset"], entry["Length"],
+			entry["PackSize"])
+		hasher = utils.TreeHasher()
+		with open(path, "wb") as output:
+			if entry["Length"]:
+				start = entry["Offset"] - first
+				resp = self.vault.job_output_response(jid, "bytes=%d-%d" %
+					(start, start + entry["Length"] - 1))
+				try:
+					remaining = entry["Length"]
+					while remaining > 0:
+						data = resp.read(min(MB, remaining))
+						if not data:
+							raise TransferError("job output ended early")
+						output.write(data)
+						hasher.update(data)
+						remaining -= len(data)
+				finally:
+					resp.close()
+
+		treehash = hasher.hexdigest()
+		if treehash != entry["SHA256TreeHash"]:
+			raise Exception("tree hash mismatch restoring " + name, entry)
+		return treehash
+
+	def locate(self, name):
+		entry = self.index.locate(self.vault.name, name)
+		if entry is None:
+			raise Exception("file is not in any pack", name)
+		return entry
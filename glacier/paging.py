@@ -0,0 +1,54 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import sys, threading
+
+class Prefetch(object):
+	""" A page requested on a thread of its own """
+
+	def __init__(self, fetch, marker):
+		self._result = None
+		self._error = None
+		self._thread = threading.Thread(target=self._run,
+			args=(fetch, marker))
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self, fetch, marker):
+		try:
+			self._result = fetch(marker)
+		except Exception:
+			self._error = sys.exc_info()
+
+	def result(self):
+		self._thread.join()
+		if self._error:
+			raise self._error[0], self._error[1], self._error[2]
+		return self._result
+
+def paginate(fetch, key, prefetch=True):
+	"""
+		Yields the entries of a paginated listing, following the markers
+		only as far as the entries are asked for.
+
+		While the entries of a page are handed out the next page is
+		already requested in the background. No more than two pages are
+		held at a time.
+
+		:param fetch: Returns the page of a marker, None for the first
+		:param key: Key of the entries in a page, e.g. ``JobList``
+		:param prefetch: Request the next page in the background
+		:type fetch: callable
+	"""
+	page = fetch(None)
+	while True:
+		marker = page.get("Marker")
+		upcoming = None
+		if marker and prefetch:
+			upcoming = Prefetch(fetch, marker)
+		for entry in page.get(key) or []:
+			yield entry
+		if not marker:
+			return
+		page = upcoming.result() if upcoming else fetch(marker)
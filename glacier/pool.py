@@ -0,0 +1,180 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import httplib, select, socket, threading, time
+from bandwidth import CHUNK_SIZE, throttle
+
+class ConnectionPool(object):
+	""" Keep-alive HTTPS connections shared by the requests of a Connection """
+
+	def __init__(self, size=10, idle_timeout=60,
+		connection_class=httplib.HTTPSConnection):
+		"""
+            Creates an empty pool
+
+			Connections are opened on demand and handed back after each
+			response has been read. Up to ``size`` idle connections are
+			kept per host, every connection beyond that is closed when it
+			is returned.
+
+			:param size: Idle connections kept per host
+			:param idle_timeout: Seconds after which an idle connection
+			is not reused anymore
+			:param connection_class: Class used to open new connections
+			:type size: integer
+			:type idle_timeout: integer, float
+        """
+		self.size = size
+		self.idle_timeout = idle_timeout
+		self.connection_class = connection_class
+		self._lock = threading.Lock()
+		self._idle = {}
+
+	def get(self, host):
+		"""
+            Returns an idle connection to the host or a new one
+
+			Connections that idled for too long or whose socket was
+			closed by the other side are dropped on the way.
+        """
+		now = time.time()
+		stale = []
+		conn = None
+		with self._lock:
+			idle = self._idle.get(host, [])
+			while idle:
+				candidate, used = idle.pop()
+				if now - used < self.idle_timeout and self.alive(candidate):
+					conn = candidate
+					break
+				stale.append(candidate)
+		for candidate in stale:
+			candidate.close()
+		if conn is None:
+			conn = self.connect(host)
+		return conn
+
+	def connect(self, host):
+		"""
+            Returns a new connection to the host, the socket itself is
+			opened with the first request sent over it
+        """
+		return self.connection_class(host)
+
+	def put(self, host, conn):
+		"""
+            Hands a connection back after its response was read entirely
+        """
+		if conn.sock is not None:
+			with self._lock:
+				idle = self._idle.setdefault(host, [])
+				if len(idle) < self.size:
+					idle.append((conn, time.time()))
+					return
+		conn.close()
+
+	def alive(self, conn):
+		"""
+            Checks whether an idle connection can still be used
+
+			An idle keep-alive socket has nothing to read. If it turns
+			readable the server either closed it or sent garbage, in both
+			cases it is of no use anymore.
+        """
+		if conn.sock is None:
+			return False
+		try:
+			readable = select.select([conn.sock], [], [], 0)[0]
+		except (select.error, socket.error, ValueError):
+			return False
+		return not readable
+
+	def close(self):
+		"""
+            Closes all idle connections
+        """
+		with self._lock:
+			idle = self._idle
+			self._idle = {}
+		for connections in idle.values():
+			for conn, _ in connections:
+				conn.close()
+
+class PooledResponse(object):
+	"""
+		Wraps an HTTP response and gives its connection back to the
+		pool once the body has been read completely.
+	"""
+
+	def __init__(self, response, pool, host, conn, limiters=()):
+		self.response = response
+		self.limiters = limiters
+		self.status = response.status
+		self.reason = response.reason
+		self._pool = pool
+		self._host = host
+		self._conn = conn
+		# Empty bodies are done right away, most callers never read them
+		if response.length == 0:
+			self.read()
+
+	def read(self, amt=None):
+		if self.limiters:
+			return self._read_limited(amt)
+		data = self.response.read(amt)
+		if self.response.isclosed():
+			self._release()
+		return data
+
+	def _read_limited(self, amt):
+		# Read in small pieces, each one waits for the bandwidth limits
+		pieces = []
+		while amt is None or amt > 0:
+			size = CHUNK_SIZE if amt is None else min(CHUNK_SIZE, amt)
+			throttle(self.limiters, size)
+			data = self.response.read(size)
+			if not data:
+				break
+			pieces.append(data)
+			if amt is not None:
+				amt -= len(data)
+		if self.response.isclosed():
+			self._release()
+		return "".join(pieces)
+
+	def getheader(self, name, default=None):
+		return self.response.getheader(name, default)
+
+	def getheaders(self):
+		return self.response.getheaders()
+
+	def isclosed(self):
+		return self.response.isclosed()
+
+	def close(self):
+		"""
+            Closes the response, if the body was not read completely the
+			connection can't be reused and is closed as well
+        """
+		if self._conn is None:
+			return
+		if not self.response.isclosed():
+			self.response.close()
+			self._conn.close()
+			self._conn = None
+		else:
+			self._release()
+
+	def _release(self):
+		if self._conn is None:
+			return
+		conn = self._conn
+		self._conn = None
+		if self.response.will_close:
+			conn.close()
+		else:
+			self._pool.put(self._host, conn)
+
+	def __getattr__(self, name):
+		return getattr(self.response, name)
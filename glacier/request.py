@@ -2,7 +2,13 @@
 # Copyright 2012 Paul Engstler
 # See LICENSE for details.
 
-import time, utils, httplib, os, math, hashlib
+import time, utils, httplib, os, math, hashlib, socket, sys
+from pool import PooledResponse
+from bandwidth import CHUNK_SIZE, throttle
+
+# Methods that can be sent twice without doing anything twice, a POST
+# may create an archive, an upload or a job
+IDEMPOTENT = ("GET", "HEAD", "PUT", "DELETE")
 
 class Request():
 
@@ -17,7 +23,8 @@ class Request():
 				the SHA-256 hash of the canonical request.
 
 			3.	The signature is being generated by singing the
-				String to Sign with the derived key.
+				String to Sign with the derived key. The key is cached
+				by the Signer of the connection.
 
 			4.	The "Authorization" header is being built by
 				combining the signature with the request.
@@ -25,10 +32,19 @@ class Request():
 	"""
 
 	def __init__(self,connection,region,method,path,signed=[],header={},
-		body=""):
+		body="",bandwidth=None):
+		self.pool = connection.pool
+		self.signer = connection.signer
+		self.limiter = connection.limiter
+		self.instrumentation = connection.instrumentation
+		self.timings = {}
+		# The bandwidth limit of the connection and the one of this
+		# transfer both apply to the body
+		self.limiters = [limiter for limiter in
+			(connection.bandwidth, bandwidth) if limiter is not None]
 		self.access_key = connection.access_key
 		self.secret_access_key = connection.secret_access_key
-		self.host = "glacier." + region + ".amazonaws.com"
+		self.host = connection.host or "glacier." + region + ".amazonaws.com"
 		self.region = region
 		self.method = method
 		self.path = path
@@ -43,45 +59,32 @@ class Request():
 		h.update(data)
 		return h.hexdigest()
 
+	def payload_hash(self):
+		if not self.header.get("x-amz-content-sha256"):
+			return self.hexhash(self.body)
+		return self.header["x-amz-content-sha256"]
 
 	def canonical_request(self):
-		# body is hashed here TODO
-		req = self.method + "\n" + self.path + "\n\n"
-		for hk in sorted(self.signed_headers):
-			hv = self.header[hk]
-			req += hk.lower()+":"+hv+"\n"
-		req += "\n" + ";".join(self.signed_headers) + "\n"
-		if not self.header.get("x-amz-content-sha256"):
-			req += self.hexhash(self.body)
-		else:
-			req += self.header["x-amz-content-sha256"]
-		return req
+		return self.signer.canonical_request(self.method, self.path,
+			self.header, self.signed_headers, self.payload_hash())
 
 	def string_to_sign(self,canonical_request):	
-		return "\n".join(["AWS4-HMAC-SHA256",self.header["x-amz-date"],
-		"%(time)s/%(region)s/glacier/aws4_request\n%(hashthing)s" % {"time":utils.time("%Y%m%d"),"region": self.region,"hashthing":self.hexhash(canonical_request)}])
+		return self.signer.string_to_sign(self.header["x-amz-date"],
+			self.region, canonical_request)
     
 	def derived_key(self):
-		kDate = utils.sign(("AWS4" + self.secret_access_key).encode("utf-8"),
-		utils.time("%Y%m%d"))
-		kRegion = utils.sign(kDate, self.region)
-		kService = utils.sign(kRegion, "glacier")
-		kSigning = utils.sign(kService, "aws4_request")
-		return kSigning
+		return self.signer.signing_key(self.header["x-amz-date"][:8],
+			self.region)
 
 	def signature(self,derivedkey,stringtosign):
 		return utils.hmac_sha256(derivedkey,stringtosign)
 
 	def build_authorization_header(self):
-		cr = self.canonical_request()
-		sts = self.string_to_sign(cr)
-		dk = self.derived_key()
-		sgn = self.signature(dk,sts)
-		return "AWS4-HMAC-SHA256 Credential="+self.access_key+"/"+\
-			utils.time("%Y%m%d")+"/"+self.region+\
-			"/glacier/aws4_request,SignedHeaders="+\
-			";".join(self.signed_headers)+\
-			",Signature="+sgn
+		# The signer caches the derived key and takes every date from
+		# the x-amz-date header, one timestamp per request.
+		return self.signer.authorization(self.method, self.path,
+			self.header, self.signed_headers, self.payload_hash(),
+			self.region)
 	
 	def build_header(self,additional):
 		header = {
@@ -96,17 +99,87 @@ class Request():
 		return header
 
 	def send_request(self):
+
+		# Keep below the request rate limit of the connection
+		if self.limiter is not None:
+			self.limiter.acquire()
 		
+		# The clock is only read for an instrumented connection
+		timed = self.instrumentation is not None
+		if timed:
+			started = time.time()
+
 		# Because of the variety of hashes that need to be processed in the
 		# Authorization header it will be baked last.
 		self.header["Authorization"] = self.build_authorization_header()
+		if timed:
+			self.timings["Sign"] = time.time() - started
 
-		# Always via HTTPS!
-		connection = httplib.HTTPSConnection(self.host)
+		# Always via HTTPS! The connection comes from the pool of the
+		# Connection and goes back there once the response was read.
+		connection = self.pool.get(self.host)
 		# uncomment if you want to debug the network i/o
 		# connection.set_debuglevel(1)
-		connection.connect()
-		
+
+		# A kept-alive connection may have been closed by the server
+		# just now, that's worth exactly one more try on a new one. The
+		# request may have reached the server before it broke off, so
+		# only idempotent ones are sent again.
+		reused = connection.sock is not None
+		try:
+			try:
+				response = self.exchange(connection, timed)
+			except (httplib.HTTPException, socket.error):
+				connection.close()
+				if not reused or self.method not in IDEMPOTENT:
+					raise
+				connection = self.pool.connect(self.host)
+				try:
+					response = self.exchange(connection, timed)
+				except:
+					connection.close()
+					raise
+		except Exception:
+			if timed:
+				self.report(None, reused, sys.exc_info()[1])
+			raise
+
+		if timed:
+			self.report(response, reused)
+		return PooledResponse(response, self.pool, self.host, connection,
+			self.limiters)
+
+	def exchange(self, connection, timed):
+		if not timed:
+			return self.send_body(connection)
+		# Open the socket (and do the TLS handshake) on its own to tell
+		# the time it takes from the time of sending
+		started = time.time()
+		if connection.sock is None:
+			connection.connect()
+		connected = time.time()
+		response = self.send_body(connection)
+		self.timings["Connect"] = connected - started
+		self.timings["Send"] = self.sent - connected
+		self.timings["FirstByte"] = time.time() - self.sent
+		return response
+
+	def report(self, response, reused, error=None):
+		if "Content-Length" in self.header:
+			sent = int(self.header["Content-Length"])
+		elif isinstance(self.body, file):
+			sent = os.fstat(self.body.fileno()).st_size
+		else:
+			sent = len(self.body)
+		event = {	"Method":self.method, "Path":self.path,
+					"Status":response.status if response else None,
+					"Error":error, "BytesSent":sent,
+					"BytesReceived":response.length if response else None,
+					"Reused":reused }
+		event.update(self.timings)
+		self.instrumentation.request(event)
+
+	def send_body(self, connection):
 		if isinstance(self.body,file):
 			# stream the file in 10 MB chunks to keep the memory usage low
 			self.body.seek(0)
@@ -117,9 +190,32 @@ class Request():
 			# send the data
 			connection.request(self.method,self.path,"",self.header)
 			for _ in range(chunk_count):
-				connection.send(self.body.read(chunk_size))
+				self.transmit(connection, self.body.read(chunk_size))
+		elif isinstance(self.body,(buffer,memoryview,bytearray)):
+			# slices of a memory mapped archive or a part buffer are sent
+			# in 1 MB pieces pointing into them, nothing gets copied
+			chunk_size = 1024*1024
+			connection.request(self.method,self.path,"",self.header)
+			for offset in range(0, len(self.body), chunk_size):
+				self.transmit(connection,
+					utils.view(self.body, offset, chunk_size))
+		elif self.limiters and self.body:
+			connection.request(self.method,self.path,"",self.header)
+			self.transmit(connection, self.body)
 		else:
 			# send the whole body
 			connection.request(self.method,self.path,self.body,self.header)
 
+		self.sent = time.time()
 		return connection.getresponse()
+
+	def transmit(self, connection, data):
+		if not self.limiters:
+			connection.send(data)
+			return
+		# Small pieces keep a limited transfer smooth and let parallel
+		# transfers take turns
+		for offset in range(0, len(data), CHUNK_SIZE):
+			piece = utils.view(data, offset, CHUNK_SIZE)
+			throttle(self.limiters, len(piece))
+			connection.send(piece)
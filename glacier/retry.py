@@ -0,0 +1,131 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import json, time, random, socket, httplib, threading
+
+# Error codes of Glacier answers that are worth another try, the
+# throttling ones come with a 400 status
+RETRYABLE_CODES = set(["ThrottlingException", "RequestTimeoutException",
+	"ServiceUnavailableException", "SlowDown", "RequestLimitExceeded"])
+
+class ResponseError(Exception):
+	"""
+
+		Raised if Glacier answers with an unexpected status. The status
+		and the error code from the body of the answer are kept, the
+		arguments stay the message and the response.
+
+	"""
+
+	def __init__(self, message, response=None):
+		Exception.__init__(self, message, response)
+		self.response = response
+		self.status = getattr(response, "status", None)
+		self.code = None
+		# Reading the body also hands the connection back to the pool
+		try:
+			self.code = json.loads(response.read()).get("code")
+		except (AttributeError, ValueError, IOError, httplib.HTTPException):
+			pass
+
+	@property
+	def retryable(self):
+		return self.code in RETRYABLE_CODES or self.status == 429 or \
+			(self.status is not None and self.status >= 500)
+
+class TransferError(IOError):
+	"""
+
+		Raised if a transfer broke off or arrived damaged, e.g. a job
+		output shorter than announced. Unlike other IOErrors, such as a
+		local file that can't be read, it is worth another try.
+
+	"""
+
+class TokenBucket(object):
+	"""
+
+		Client side request rate limit. Every request takes a token,
+		tokens come back at ``rate`` per second up to ``burst`` of them.
+		The burst is at least one token, otherwise a rate below one
+		request per second would never let a request through.
+
+	"""
+
+	def __init__(self, rate, burst=None):
+		self.rate = float(rate)
+		self.burst = max(1.0, float(burst or rate))
+		self.tokens = self.burst
+		self.updated = time.time()
+		self._lock = threading.Lock()
+
+	def acquire(self, tokens=1):
+		"""
+            Takes tokens, waiting until there are enough
+        """
+		while True:
+			with self._lock:
+				now = time.time()
+				self.tokens = min(self.burst,
+					self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				if self.tokens >= tokens:
+					self.tokens -= tokens
+					return
+				wait = (tokens - self.tokens) / self.rate
+			time.sleep(wait)
+
+class RetryPolicy(object):
+	"""
+
+		Decides which errors are tried again and how long to wait.
+
+		Server errors, throttling answers, socket errors and transfers
+		that broke off are retried, other client errors are not. The
+		waits grow exponentially and are drawn at random below the
+		limit ("full jitter"), so clients throttled at the same time
+		don't come back at the same time.
+
+	"""
+
+	def __init__(self, attempts=5, base=0.2, cap=20.0):
+		"""
+            :param attempts: Number of tries in all, 1 never retries
+			:param base: Wait limit in seconds after the first failure
+			:param cap: Highest wait limit in seconds
+        """
+		self.attempts = attempts
+		self.base = base
+		self.cap = cap
+		self.retries = 0
+		self._lock = threading.Lock()
+
+	def retryable(self, error):
+		if isinstance(error, ResponseError):
+			return error.retryable
+		return isinstance(error, (socket.error, httplib.HTTPException,
+			TransferError))
+
+	def delay(self, attempt):
+		"""
+            Returns the seconds to wait after the ``attempt``-th failure
+        """
+		return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+	def call(self, func, *args):
+		"""
+            Calls func until it succeeds, it raises an error that isn't
+			retryable or all attempts are used up
+        """
+		attempt = 0
+		while True:
+			try:
+				return func(*args)
+			except Exception, error:
+				attempt += 1
+				if attempt >= self.attempts or not self.retryable(error):
+					raise
+				with self._lock:
+					self.retries += 1
+				time.sleep(self.delay(attempt - 1))
@@ -0,0 +1,286 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import os, sys, time, heapq, threading, Queue, collections
+from archive import Archive
+
+class UploadQueue(object):
+	"""
+
+		The upload tasks of a scheduler: whole archives, smallest first,
+		and the parts of multi-part uploads in the order they were
+		queued, so the archive started first is finished first.
+
+		A worker takes from the side it prefers and from the other one
+		if that side is empty.
+
+	"""
+
+	def __init__(self):
+		self._condition = threading.Condition()
+		self._archives = []
+		self._parts = collections.deque()
+		self._sequence = 0
+		self._closed = False
+
+	def put(self, archive, part=None):
+		with self._condition:
+			if part is None:
+				# The sequence keeps archives of one size in order, they
+				# are never compared
+				self._sequence += 1
+				heapq.heappush(self._archives,
+					(archive.size, self._sequence, archive))
+			else:
+				self._parts.append((archive, part))
+			self._condition.notify()
+
+	def get(self, parts_first=False):
+		"""
+            Returns the next task (archive, part), part None for a whole
+			archive, or (None, None) once the queue is closed and empty
+        """
+		with self._condition:
+			while True:
+				if self._parts and (parts_first or not self._archives):
+					return self._parts.popleft()
+				if self._archives:
+					return heapq.heappop(self._archives)[2], None
+				if self._closed:
+					return None, None
+				self._condition.wait()
+
+	def close(self):
+		"""
+            Lets the workers end once the queued tasks are taken
+        """
+		with self._condition:
+			self._closed = True
+			self._condition.notify_all()
+
+	def qsize(self):
+		with self._condition:
+			return len(self._archives) + len(self._parts)
+
+class UploadScheduler(object):
+	"""
+
+		Uploads many files as a pipeline of three stages running at the
+		same time: a scanner opening the files, a few threads hashing
+		them and one pool of threads uploading for all archives.
+
+		The upload pool works on single archives and on the parts of
+		multi-part uploads alike. Most upload threads pick the smallest
+		waiting archive first and parts only when no archive waits. One
+		in four of them (at least one, unless there is a single thread)
+		picks parts first, so a big archive streams on while the scan
+		keeps finding small files. At most ``max_open`` archives are
+		between scanning and the end of their upload, which bounds the
+		open files.
+
+		The multi-part upload of an archive that failed is aborted.
+
+		stats() can be called from any thread while run() is working.
+
+	"""
+
+	def __init__(self, vault, concurrency=4, hash_workers=2, max_open=None,
+		progress=None):
+		"""
+            :param vault: Vault the archives are uploaded to
+			:param concurrency: Number of uploads and parts in flight
+			:param hash_workers: Number of files hashed at the same time
+			:param max_open: Number of archives in the pipeline at once
+			(optional, four per upload thread)
+			:param progress: Called with stats() after every archive and
+			at the end (optional)
+			:type vault: Vault
+			:type progress: callable
+        """
+		self.vault = vault
+		self.concurrency = concurrency
+		self.hash_workers = hash_workers
+		self.progress = progress
+		self.open = threading.Semaphore(max_open or concurrency * 4)
+		self.hash_queue = Queue.Queue()
+		self.upload_queue = UploadQueue()
+		self._lock = threading.Lock()
+		self.remaining = {}
+		self.archives = []
+		self.errors = {}
+		self.scanned = 0
+		self.hashed = 0
+		self.uploaded_bytes = 0
+		self.started = None
+		self.finished = None
+
+	def scan(self, paths):
+		"""
+            Yields the files to upload, directories are walked
+        """
+		for path in paths:
+			if os.path.isdir(path):
+				for root, dirs, files in os.walk(path):
+					dirs.sort()
+					for name in sorted(files):
+						full = os.path.join(root, name)
+						if os.path.isfile(full):
+							yield full
+			else:
+				yield path
+
+	def run(self, paths):
+		"""
+            Uploads the files and directories and returns once all of
+			them are stored or failed
+
+			:return: The uploaded archives and the error of every file
+			that failed
+			:rtype: tuple (list, dictionary)
+        """
+		self.started = time.time()
+		scanner = self.start(self.scanner, paths)
+		hashers = [self.start(self.hasher) for _ in range(self.hash_workers)]
+		# Threads reserved for the parts of big archives
+		reserved = max(1, self.concurrency / 4) if self.concurrency > 1 \
+			else 0
+		uploaders = [self.start(self.uploader, number < reserved)
+			for number in range(self.concurrency)]
+
+		scanner.join()
+		for _ in hashers:
+			self.hash_queue.put(None)
+		for thread in hashers:
+			thread.join()
+		# Every task is queued now
+		self.upload_queue.close()
+		for thread in uploaders:
+			thread.join()
+
+		self.finished = time.time()
+		if self.progress is not None:
+			self.progress(self.stats())
+		return self.archives, self.errors
+
+	def start(self, target, *args):
+		thread = threading.Thread(target=target, args=args)
+		thread.daemon = True
+		thread.start()
+		return thread
+
+	def stats(self):
+		"""
+            Returns the progress, the throughput in bytes per second and
+			the number of items waiting in front of every stage
+
+			:rtype: dictionary
+        """
+		elapsed = (self.finished or time.time()) - (self.started or time.time())
+		with self._lock:
+			return {	"Scanned":self.scanned, "Hashed":self.hashed,
+						"Uploaded":len(self.archives),
+						"Failed":len(self.errors),
+						"BytesUploaded":self.uploaded_bytes,
+						"Seconds":elapsed,
+						"Throughput":self.uploaded_bytes / elapsed
+							if elapsed > 0 else 0.0,
+						"QueueDepth":{	"Hash":self.hash_queue.qsize(),
+										"Upload":self.upload_queue.qsize() } }
+
+	def open_archive(self, path):
+		return Archive(path,
+			instrumentation=self.vault.connection.instrumentation)
+
+	def scanner(self, paths):
+		for path in self.scan(paths):
+			self.open.acquire()
+			try:
+				archive = self.open_archive(path)
+			except Exception:
+				self.fail(path, sys.exc_info()[1])
+				self.open.release()
+				continue
+			with self._lock:
+				self.scanned += 1
+			self.hash_queue.put(archive)
+
+	def hasher(self):
+		while True:
+			archive = self.hash_queue.get()
+			if archive is None:
+				return
+			try:
+				archive.calculate_tree_hash()
+				if archive.partcount > 1:
+					self.vault.initiate_multipart_upload(archive)
+					parts = range(archive.partcount)
+				else:
+					parts = [None]
+			except Exception:
+				self.fail(archive.path, sys.exc_info()[1])
+				self.release(archive)
+				continue
+
+			with self._lock:
+				self.hashed += 1
+				self.remaining[archive] = len(parts)
+				for part in parts:
+					self.upload_queue.put(archive, part)
+
+	def uploader(self, parts_first=False):
+		while True:
+			archive, part = self.upload_queue.get(parts_first)
+			if archive is None:
+				return
+			if archive.path not in self.errors:
+				try:
+					if part is None:
+						self.vault.upload(archive)
+						size = archive.size
+					else:
+						self.vault.upload_part(archive, part)
+						size = archive.part_size(part)
+					with self._lock:
+						self.uploaded_bytes += size
+				except Exception:
+					self.fail(archive.path, sys.exc_info()[1])
+
+			with self._lock:
+				self.remaining[archive] -= 1
+				last = not self.remaining[archive]
+				if last:
+					del self.remaining[archive]
+			if last:
+				self.complete(archive, part)
+
+	def complete(self, archive, part):
+		"""
+            Finishes an archive once all of its tasks are done
+        """
+		if part is not None and archive.path not in self.errors:
+			try:
+				self.vault.complete_multipart_upload(archive)
+			except Exception:
+				self.fail(archive.path, sys.exc_info()[1])
+		if part is not None and archive.path in self.errors:
+			# Nothing is returned that could resume it, the parts sent
+			# would only be kept by Glacier until it expires
+			try:
+				self.vault.abort_multipart_upload(archive)
+			except Exception:
+				pass
+		if archive.path not in self.errors:
+			with self._lock:
+				self.archives.append(archive)
+		self.release(archive)
+		if self.progress is not None:
+			self.progress(self.stats())
+
+	def fail(self, path, error):
+		with self._lock:
+			self.errors.setdefault(path, error)
+
+	def release(self, archive):
+		archive.close()
+		self.open.release()
@@ -0,0 +1,95 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import threading, utils
+
+class Signer(object):
+	"""
+
+		Signs requests with AWS Signature Version 4. One signer is held
+		by each Connection and shared by all of its requests.
+
+		The signing key only depends on the date, the region and the
+		service, so it is derived once per day instead of running the
+		four HMAC rounds for every request.
+
+	"""
+
+	def __init__(self, access_key, secret_access_key, service="glacier"):
+		self.access_key = access_key
+		self.secret_access_key = secret_access_key
+		self.service = service
+		self._keys = {}
+		self._lock = threading.Lock()
+
+	def signing_key(self, datestamp, region, service=None):
+		"""
+            Returns the derived signing key for the date, region and
+			service, deriving it only if it isn't cached yet
+
+			:param datestamp: Date in the format YYYYMMDD
+			:type datestamp: string
+        """
+		service = service or self.service
+		cache_key = (datestamp, region, service)
+		key = self._keys.get(cache_key)
+		if key is None:
+			kDate = utils.sign(("AWS4" + self.secret_access_key).encode("utf-8"),
+				datestamp)
+			kRegion = utils.sign(kDate, region)
+			kService = utils.sign(kRegion, service)
+			key = utils.sign(kService, "aws4_request")
+			with self._lock:
+				# Yesterday's keys won't be needed anymore
+				if len(self._keys) > 16:
+					self._keys.clear()
+				self._keys[cache_key] = key
+		return key
+
+	def scope(self, datestamp, region):
+		return datestamp + "/" + region + "/" + self.service + "/aws4_request"
+
+	def canonical_request(self, method, path, header, signed_headers,
+		payload_hash):
+		"""
+            Returns the canonical request, the header block is built in
+			a single pass over the sorted signed header names
+
+			A query string in the path has to be built with
+			utils.query_string, it is used as is.
+        """
+		path, _, query = path.partition("?")
+		lines = [method, path, query]
+		lines.extend([hk + ":" + header[hk] for hk in signed_headers])
+		lines.append("")
+		lines.append(";".join(signed_headers))
+		lines.append(payload_hash)
+		return "\n".join(lines)
+
+	def string_to_sign(self, amzdate, region, canonical_request):
+		return "\n".join(["AWS4-HMAC-SHA256", amzdate,
+			self.scope(amzdate[:8], region),
+			utils.hexhash(canonical_request)])
+
+	def authorization(self, method, path, header, signed_headers,
+		payload_hash, region):
+		"""
+            Returns the value of the Authorization header
+
+			All dates are taken from the ``x-amz-date`` header, so a
+			request is signed with exactly one timestamp.
+
+			:param signed_headers: Sorted, lower case header names
+			:param payload_hash: Hexdigested SHA256 hash of the body
+        """
+		amzdate = header["x-amz-date"]
+		datestamp = amzdate[:8]
+		cr = self.canonical_request(method, path, header, signed_headers,
+			payload_hash)
+		sts = self.string_to_sign(amzdate, region, cr)
+		sgn = utils.hmac_sha256(self.signing_key(datestamp, region), sts)
+		return "AWS4-HMAC-SHA256 Credential=" + self.access_key + "/" +\
+			self.scope(datestamp, region) +\
+			",SignedHeaders=" + ";".join(signed_headers) +\
+			",Signature=" + sgn
@@ -0,0 +1,223 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import sys, hashlib, itertools, threading, Queue, utils
+
+def read_chunks(source, size):
+	"""
+		Yields the data of a file-like object or an iterator of strings,
+		a file-like object is read ``size`` bytes at a time
+	"""
+	if hasattr(source, "read"):
+		while True:
+			data = source.read(size)
+			if not data:
+				return
+			yield data
+	else:
+		for data in source:
+			if data:
+				yield data
+
+class BufferPool(object):
+	"""
+
+		A fixed number of part buffers handed out and given back, taking
+		one waits while all of them are in use. Buffers are reused, the
+		memory of a streaming upload stays at count * size bytes.
+
+	"""
+
+	def __init__(self, count, size):
+		self.size = size
+		self._free = Queue.Queue()
+		for _ in range(count):
+			self._free.put(bytearray(size))
+
+	def get(self):
+		return self._free.get()
+
+	def put(self, buffer):
+		self._free.put(buffer)
+
+class StreamArchive(object):
+	"""
+
+		An archive read from a stream. Its size and tree hash are only
+		known once the stream has been read to the end.
+
+	"""
+
+	def __init__(self, partsize):
+		self.partsize = partsize
+		self.size = 0
+		self.hash = None
+		self.treehash = None
+		self.part_treehashes = []
+		self.multi_part_id = None
+		self.description = ""
+		self.id = None
+
+	@property
+	def partcount(self):
+		return len(self.part_treehashes)
+
+class StreamUploader(object):
+	"""
+
+		Uploads a stream of unknown size as a multi-part upload without
+		staging it on disk, e.g. the output of tar or a database dump.
+
+		The stream is read into part buffers taken from a BufferPool.
+		Each part is tree hashed while it is filled and handed to the
+		upload threads as soon as it is full, the next part is read
+		while the previous ones are being sent. Once the stream ends the
+		size and tree hash of the archive are put together from the
+		parts and the upload is completed.
+
+		A stream can't be read a second time, if anything fails the
+		multi-part upload is aborted and the error is raised. That
+		includes a stream longer than ``max_parts`` parts, the upload
+		is given up as soon as the part after the last one is read. An
+		empty stream is rejected before an upload is initiated.
+
+	"""
+
+	# Glacier's limit of parts per multi-part upload
+	max_parts = 10000
+
+	def __init__(self, vault, partsize=1024*1024*64, concurrency=4,
+		bandwidth=None, read_size=1024*1024):
+		"""
+            :param vault: Vault the stream is uploaded to
+			:param partsize: Bytes per part, a power of two multiple of
+			1 MB. Glacier takes 10,000 parts, 64 MB parts allow for
+			streams of 640 GB.
+			:param concurrency: Number of parts sent at the same time
+			:param bandwidth: BandwidthLimiter shared by the parts
+			(optional)
+			:param read_size: Bytes read from a file-like stream at once
+			:type vault: Vault
+        """
+		chunks = partsize / (1024*1024)
+		if partsize % (1024*1024) or not chunks or chunks & (chunks - 1) \
+			or chunks > 4096:
+			raise ValueError("part size must be a power of two multiple " +
+				"of 1 MB up to 4 GB")
+		self.vault = vault
+		self.partsize = partsize
+		self.concurrency = concurrency
+		self.bandwidth = bandwidth
+		self.read_size = read_size
+
+	def parts(self, source, pool):
+		"""
+            Yields the parts of the stream as tuples (buffer, length,
+			tree hash, linear hash), the buffers come from the pool
+        """
+		part = None
+		count = 0
+		for data in read_chunks(source, self.read_size):
+			offset = 0
+			while offset < len(data):
+				if part is None:
+					if count == self.max_parts:
+						raise ValueError("stream is longer than %d parts " \
+							"of %d bytes" % (self.max_parts, self.partsize))
+					count += 1
+					part = pool.get()
+					length = 0
+					treehasher = utils.TreeHasher()
+					linear = hashlib.sha256()
+				take = min(len(data) - offset, self.partsize - length)
+				piece = utils.view(data, offset, take)
+				part[length:length+take] = piece
+				treehasher.update(piece)
+				linear.update(piece)
+				length += take
+				offset += take
+				if length == self.partsize:
+					yield part, length, treehasher.hexdigest(), \
+						linear.hexdigest()
+					part = None
+		if part is not None:
+			yield part, length, treehasher.hexdigest(), linear.hexdigest()
+
+	def upload(self, source, description=""):
+		"""
+            Uploads everything the stream yields as one archive
+
+			:param source: A file-like object or an iterator of strings
+			:param description: Description of the archive (optional)
+
+			:return: The archive with its id, size and tree hash
+			:rtype: StreamArchive
+        """
+		# One buffer more than parts in flight, the next part is read
+		# while the others are sent
+		pool = BufferPool(self.concurrency + 1, self.partsize)
+		parts = self.parts(source, pool)
+		# Nothing is initiated for a stream without any data
+		try:
+			first = parts.next()
+		except StopIteration:
+			raise ValueError("stream is empty")
+
+		archive = StreamArchive(self.partsize)
+		self.vault.initiate_multipart_upload(archive, description)
+		queue = Queue.Queue()
+		errors = []
+
+		def worker():
+			while True:
+				item = queue.get()
+				if item is None:
+					return
+				part, offset, length, treehash, linear = item
+				try:
+					if not errors:
+						self.vault.upload_part_data(archive.multi_part_id,
+							offset, utils.view(part, 0, length), treehash,
+							linear, self.bandwidth)
+				except Exception:
+					errors.append(sys.exc_info())
+				finally:
+					pool.put(part)
+
+		workers = []
+		for _ in range(self.concurrency):
+			thread = threading.Thread(target=worker)
+			thread.daemon = True
+			thread.start()
+			workers.append(thread)
+
+		try:
+			try:
+				for part, length, treehash, linear in itertools.chain(
+					[first], parts):
+					if errors:
+						pool.put(part)
+						break
+					queue.put((part, archive.size, length, treehash, linear))
+					archive.part_treehashes.append(treehash)
+					archive.size += length
+			finally:
+				for thread in workers:
+					queue.put(None)
+				for thread in workers:
+					thread.join()
+			if errors:
+				raise errors[0][0], errors[0][1], errors[0][2]
+
+			archive.treehash = utils.combine_tree_hashes(
+				archive.part_treehashes)
+			self.vault.complete_multipart_upload(archive)
+		except:
+			error = sys.exc_info()
+			try:
+				self.vault.abort_multipart_upload(archive)
+			except Exception:
+				pass
+			raise error[0], error[1], error[2]
+		return archive
@@ -2,7 +2,7 @@
 # Copyright 2012 Paul Engstler
 # See LICENSE for details.
 
-import hashlib, hmac
+import hashlib, hmac, urllib
 from time import strftime, gmtime
 
 def hexhash(data):
@@ -15,12 +15,17 @@ def sha256(value):
 	"""
 		Returns the hexdigested SHA256 hash of the object.
 
-		:type value: string or file
+		:type value: string, file, buffer, bytearray, mmap or memoryview
 	"""
-	if isinstance(value, str):
-		return hexhash(value)
-	elif isinstance(value, file):
+	if isinstance(value, file):
 		return sha256_file(value)
+	if isinstance(value, unicode):
+		raise TypeError("unicode must be encoded before hashing")
+	try:
+		return hexhash(value)
+	except TypeError:
+		raise TypeError("can't hash an object of type " +
+			type(value).__name__)
 
 def sha256_digest(value):
 	"""
@@ -30,6 +35,16 @@ def sha256_digest(value):
 	"""
 	return hashlib.sha256(value).digest()
 
+def view(data, offset, length):
+	"""
+		Returns a slice of the data without copying it.
+
+		:type data: string, buffer, bytearray, mmap or memoryview
+	"""
+	if isinstance(data, memoryview):
+		return data[offset:offset+length]
+	return buffer(data, offset, length)
+
 def sha256_file(file_to_hash):
 	"""
 		Returns the hexdigested SHA256 hash of the given file.
@@ -41,7 +56,7 @@ def sha256_file(file_to_hash):
 	sha256 = hashlib.sha256()
 	file_to_hash.seek(0)
 	while True:
-		data = file_to_hash.read(256)
+		data = file_to_hash.read(1024*1024)
 		if not data:
 			break
 		sha256.update(data)
@@ -66,24 +81,165 @@ def get_tree_hash(chunk_hashes):
 		:type chunk_hashes: list, tuple
 	"""
 
-	hashes = chunk_hashes[:]
+	hashes = list(chunk_hashes)
 
 	while len(hashes) > 1:
-		new_hashes = []
-		while len(hashes) > 0:
-			if len(hashes) > 1:
-				# at least two hashes available
-				first = hashes.pop(0)
-				second = hashes.pop(0)
-				new_hashes.append(sha256_digest(first+second))
-			elif len(hashes) == 1:
-				# just one hash available and because he has no hash partner :(
-				# we move him to the next level as well.
-				new_hashes.append(hashes.pop(0))
-		# move to the next level
-		hashes.extend(new_hashes)
+		# hash the pairs of this level, a hash without partner (poor
+		# thing) moves on to the next level as it is
+		new_hashes = [sha256_digest(hashes[i] + hashes[i+1])
+			for i in range(0, len(hashes) - 1, 2)]
+		if len(hashes) % 2:
+			new_hashes.append(hashes[-1])
+		hashes = new_hashes
 	return hashes[0].encode("hex")
 
+def combine_tree_hashes(tree_hashes):
+	"""
+		Returns the tree hash of consecutive ranges from the tree hashes
+		of the ranges themselves.
+
+		All ranges but the last one have to be the same power of two
+		number of megabytes, just like the parts of a multi-part upload.
+		Their subtrees are then exactly the subtrees of the whole tree.
+
+		:type tree_hashes: list, tuple of hexdigested tree hashes
+	"""
+	return get_tree_hash([treehash.decode("hex") for treehash in tree_hashes])
+
+def part_size_for(size, min_parts=8, max_parts=10000, single_part=64*1024*1024):
+	"""
+		Returns the part size of a multi-part upload of ``size`` bytes.
+
+		The part size is a power of two number of megabytes between 1 MB
+		and 4 GB. Archives of up to ``single_part`` bytes get a part as
+		big as the whole archive, they are sent in a single request:
+		initiating and completing a multi-part upload costs two round
+		trips that splitting a small archive doesn't win back. Bigger
+		archives are split into about ``min_parts`` parts that can be
+		sent at the same time, but never into more than ``max_parts``
+		parts (Glacier's limit is 10,000).
+
+		:type size: integer
+	"""
+	mb = 1024*1024
+	partsize = mb
+	if size <= single_part:
+		while partsize < size:
+			partsize *= 2
+		return partsize
+	while partsize < 64*mb and partsize * 2 * min_parts <= size:
+		partsize *= 2
+	while partsize * max_parts < size:
+		partsize *= 2
+	if partsize > 4096*mb:
+		raise ValueError("archive is too big for a multi-part upload", size)
+	return partsize
+
+class TreeHasher(object):
+	"""
+
+		Calculates a tree hash incrementally, the data can be passed in
+		pieces of any size.
+
+		Only a stack of subtree digests is kept, one per level at most,
+		so hashing a terabyte needs no more memory than hashing a
+		megabyte. Whenever two subtrees of the same level are on top of
+		the stack they are combined right away.
+
+	"""
+
+	chunk_size = 1024*1024
+
+	def __init__(self, data=None, leaves=None):
+		"""
+            :param data: Data to start with (optional)
+			:param leaves: List that the digest of every full 1 MB chunk
+			gets appended to (optional), see partial_leaf for the last
+			one
+			:type leaves: list
+        """
+		self.size = 0
+		self._stack = []
+		self._leaf = hashlib.sha256()
+		self._leaf_size = 0
+		self._leaves = leaves
+		if data:
+			self.update(data)
+
+	def update(self, data):
+		offset = 0
+		length = len(data)
+		while offset < length:
+			take = min(self.chunk_size - self._leaf_size, length - offset)
+			self._leaf.update(view(data, offset, take))
+			self._leaf_size += take
+			offset += take
+			if self._leaf_size == self.chunk_size:
+				self._push(self._leaf.digest())
+				self._leaf = hashlib.sha256()
+				self._leaf_size = 0
+		self.size += length
+
+	def _push(self, digest):
+		if self._leaves is not None:
+			self._leaves.append(digest)
+		level = 0
+		while self._stack and self._stack[-1][0] == level:
+			digest = sha256_digest(self._stack.pop()[1] + digest)
+			level += 1
+		self._stack.append((level, digest))
+
+	def digest(self):
+		"""
+            Returns the digested tree hash of the data passed so far
+        """
+		stack = [digest for _, digest in self._stack]
+		leaf = self.partial_leaf()
+		if leaf is not None:
+			stack.append(leaf)
+
+		# The stack holds the subtrees from left to right with falling
+		# levels, folding it from the right gives the root
+		digest = stack.pop()
+		while stack:
+			digest = sha256_digest(stack.pop() + digest)
+		return digest
+
+	def hexdigest(self):
+		"""
+            Returns the hexdigested tree hash of the data passed so far
+        """
+		return self.digest().encode("hex")
+
+	def partial_leaf(self):
+		"""
+            Returns the digest of the chunk shorter than 1 MB at the end
+			of the data passed so far, or of no data if nothing was
+			passed, None if the data ends with a full chunk
+
+			It isn't appended to leaves, more data may still fill it up.
+			Add it once all data is passed.
+        """
+		if self._leaf_size or not self._stack:
+			return self._leaf.digest()
+		return None
+
+def query_string(params):
+	"""
+		Returns the query string of the parameters, sorted and encoded
+		the way the canonical request of a signature expects it. Empty
+		parameters are left out.
+
+		:type params: dictionary
+	"""
+	pairs = []
+	for key in sorted(params.keys()):
+		if params[key] is None or params[key] == "":
+			continue
+		pairs.append(urllib.quote(str(key), safe="-_.~") + "=" +
+			urllib.quote(str(params[key]), safe="-_.~"))
+	return "&".join(pairs)
+
 def time(format="%Y%m%d"):
 	"""
 		Returns the time in a certain format.
@@ -2,8 +2,53 @@
 # Copyright 2012 Paul Engstler
 # See LICENSE for details.
 
-import json
+import json, sys, time, threading, Queue, utils
 from request import Request
+from journal import UploadJournal
+from inventory import InventoryReader
+from scheduler import UploadScheduler
+from stream import StreamUploader
+from compress import Compressor
+from archive import Archive
+from adaptive import AdaptiveConcurrency, run_adaptive
+from retry import ResponseError, TransferError
+from paging import paginate
+
+def run_parallel(func, items, concurrency):
+	"""
+		Calls func for each item on at most ``concurrency`` threads and
+		returns once all items are done. The first error stops the
+		remaining items and is raised again with its traceback.
+	"""
+	queue = Queue.Queue()
+	for item in items:
+		queue.put(item)
+
+	errors = []
+
+	def worker():
+		while not errors:
+			try:
+				item = queue.get_nowait()
+			except Queue.Empty:
+				return
+			try:
+				func(item)
+			except Exception:
+				errors.append(sys.exc_info())
+				return
+
+	workers = []
+	for _ in range(max(1, min(concurrency, queue.qsize()))):
+		thread = threading.Thread(target=worker)
+		thread.daemon = True
+		thread.start()
+		workers.append(thread)
+	for thread in workers:
+		thread.join()
+
+	if errors:
+		raise errors[0][0], errors[0][1], errors[0][2]
 
 class Vault(object):
 	""" Vault API """
@@ -60,30 +105,48 @@ class Vault(object):
 		resp = req.send_request()
 
 		if resp.status != 201:
-			raise Exception("archive could not be created", resp)
+			raise ResponseError("archive could not be created", resp)
 
 		# assign the id to the archive
 		archive.id = resp.getheader("x-amz-archive-id")
+		self.index_archive(archive, description)
 
 		return archive
 
-	def list_multipart_uploads(self):
+	def list_multipart_uploads(self, marker=None, limit=None):
 		"""
-            Lists the current multi-uploads in progress
+            Lists the current multi-uploads in progress, one page at a
+			time
             
+			:param marker: Marker of the page to list (optional)
+			:param limit: Maximum number of uploads to list (optional)
+
 			:return: Parsed answer from Amazon Glacier
 			:rtype: dictionary
         """
-		req = self.connection.make_request(	"GET",
-											"/-/vaults/"+self.name
-											+"/multipart-uploads")
+		path = "/-/vaults/"+self.name+"/multipart-uploads"
+		query = utils.query_string({ "marker":marker, "limit":limit })
+		if query:
+			path += "?" + query
+		req = self.connection.make_request(	"GET", path)
 		resp = req.send_request()
 	
 		if resp.status != 200:
-			raise Exception("could not get uploads", resp)
+			raise ResponseError("could not get uploads", resp)
 
 		return json.loads(resp.read())
 
+	def iter_multipart_uploads(self, limit=None):
+		"""
+            Yields the multi-part uploads in progress, the pages are
+			requested while the uploads are read
+
+			:param limit: Uploads per page (optional)
+			:rtype: iterator of dictionaries
+        """
+		return paginate(lambda marker: self.list_multipart_uploads(marker,
+			limit), "UploadsList")
+
 	def initiate_multipart_upload(self, archive, description=""):
 		"""
             Starts a multipart upload to this vault
@@ -108,56 +171,310 @@ class Vault(object):
 		resp = req.send_request()
 
 		if resp.status != 201:
-			raise Exception("archive could not be created", resp)
+			raise ResponseError("archive could not be created", resp)
 
 		# set the ID provided to the multi-part upload into the archive
 		archive.multi_part_id = resp.getheader("x-amz-multipart-upload-id")
+		archive.description = description
 		return archive.multi_part_id
 
-	def upload_part(self, archive, part):
+	def upload_part(self, archive, part, bandwidth=None):
 		"""
             Uploads an archive to this vault
+
+			Failed attempts are retried following the retry policy of
+			the connection, the part is read again for every attempt.
             
 			:param archive: An archive initialized with a file name
 			:param part: Description of the archive (optional)
+			:param bandwidth: BandwidthLimiter of the transfer (optional)
 
 			:rtype: archive
         """
+		return self.connection.retry.call(self._upload_part, archive, part,
+			bandwidth)
+
+	def _upload_part(self, archive, part, bandwidth):
+		return self._upload_part_data(archive.multi_part_id,
+			archive.partsize * part, archive.read_part(part),
+			archive.calculate_tree_hash(part), archive.part_hash(part),
+			bandwidth)
+
+	def upload_part_data(self, upload_id, offset, data, treehash=None,
+		linear_hash=None, bandwidth=None):
+		"""
+            Uploads a part held in memory to a multi-part upload,
+			retried like upload_part
+
+			:param upload_id: Id of the multi-part upload
+			:param offset: Position of the part in the archive
+			:param data: The part, e.g. a buffer of a bytearray
+			:param treehash: Tree hash of the part (optional, calculated)
+			:param linear_hash: SHA256 hash of the part (optional,
+			calculated)
+			:param bandwidth: BandwidthLimiter of the transfer (optional)
+			:type data: string, buffer, bytearray or memoryview
+
+			:rtype: boolean
+        """
+		if treehash is None:
+			treehash = utils.TreeHasher(data).hexdigest()
+		if linear_hash is None:
+			linear_hash = utils.hexhash(data)
+		return self.connection.retry.call(self._upload_part_data, upload_id,
+			offset, data, treehash, linear_hash, bandwidth)
+
+	def _upload_part_data(self, upload_id, offset, data, treehash,
+		linear_hash, bandwidth):
 		header = 	{ 	
-							"Content-Length":str(archive.part_size(part)), 
-							"Content-Range":archive.content_range(part), 
+							"Content-Length":str(len(data)), 
+							"Content-Range":"bytes " + str(offset) + "-" +
+								str(offset + len(data) - 1) + "/*",
 							"Content-Type":"application/octet-stream",
-							"x-amz-sha256-tree-hash":archive.calculate_tree_hash(part),
-							"x-amz-content-sha256":archive.part_hash(part)
+							"x-amz-sha256-tree-hash":treehash,
+							"x-amz-content-sha256":linear_hash
 					}
 
 		req = self.connection.make_request(	"PUT",
-											"/-/vaults/"+self.name+"/multipart-uploads/"+archive.multi_part_id,
+											"/-/vaults/"+self.name+"/multipart-uploads/"+upload_id,
 											signed=["x-amz-content-sha256"],
 											header=header,
-											body=archive.read_part(part))
+											body=data,
+											bandwidth=bandwidth)
 											
 		resp = req.send_request()
 
 		if resp.status != 204:
-			raise Exception("error completing multi-part upload process", resp)
+			raise ResponseError("error completing multi-part upload process", resp)
 
 		return True
 
-	def list_upload_parts(self, archive):
+	def upload_multipart(self, archive, concurrency=4, description="",
+		journal=None, bandwidth=None):
+		"""
+            Uploads an archive in parts using a pool of worker threads
+
+			The multi-part upload is initiated, the parts are uploaded
+			with at most ``concurrency`` of them in flight and the upload
+			is completed. Only the parts being sent are held in memory,
+			about concurrency * archive.partsize bytes.
+
+			With an AdaptiveConcurrency instead of a number the parts in
+			flight follow the measured throughput and errors. Every
+			failed attempt lowers the limit, a part is sent again as
+			often and after the same waits as the retry policy of the
+			connection allows.
+
+			If a part fails the error is raised and the upload is left
+			open, archive.multi_part_id can be used to resume or abort it.
+			With a journal that happens automatically: the next call with
+			the same journal only sends the parts that are missing.
+
+			:param archive: An archive initialized with a file name
+			:param concurrency: Number of parts uploaded at the same time
+			:param description: Description of the archive (optional)
+			:param journal: Path of the journal file recording the upload
+			(optional)
+			:param bandwidth: BandwidthLimiter shared by the parts of this
+			upload (optional)
+			:type concurrency: integer or AdaptiveConcurrency
+
+			:return: The archive id and the seconds each sent part took
+			:rtype: tuple (string, dictionary)
+        """
+		# Hash before any part goes out, the workers then only read
+		# the part they are sending
+		archive.calculate_tree_hash()
+
+		stored = None
+		if journal is not None:
+			journal = UploadJournal(journal)
+			stored = self.resume_multipart_upload(archive, journal)
+		if stored is None:
+			stored = set()
+			self.initiate_multipart_upload(archive, description)
+			if journal is not None:
+				journal.start(archive)
+
+		timings = {}
+		adaptive = isinstance(concurrency, AdaptiveConcurrency)
+
+		def send(part):
+			started = time.time()
+			if adaptive:
+				# run_adaptive retries, it must see every failure
+				self._upload_part(archive, part, bandwidth)
+			else:
+				self.upload_part(archive, part, bandwidth)
+			timings[part] = time.time() - started
+			return archive.part_size(part)
+
+		missing = [part for part in range(archive.partcount)
+			if part not in stored]
+		if adaptive:
+			retry = self.connection.retry
+			run_adaptive(send, missing, concurrency, retry.attempts,
+				retry.retryable, retry.delay)
+		else:
+			run_parallel(send, missing, concurrency)
+
+		self.complete_multipart_upload(archive)
+		if journal is not None:
+			journal.remove()
+		return archive.id, timings
+
+	def upload_stream(self, source, description="", partsize=1024*1024*64,
+		concurrency=4, bandwidth=None):
+		"""
+            Uploads a non-seekable stream of unknown size, e.g. standard
+			input, in parts without staging it on disk
+
+			At most concurrency + 1 parts are held in memory, see
+			StreamUploader. The upload is aborted if anything fails.
+
+			:param source: A file-like object or an iterator of strings
+			:param description: Description of the archive (optional)
+			:param partsize: Bytes per part, a power of two multiple of
+			1 MB, it limits the size of the stream to 10,000 parts
+			:param concurrency: Number of parts uploaded at the same time
+			:param bandwidth: BandwidthLimiter shared by the parts of this
+			upload (optional)
+
+			:return: The archive with its id, size and tree hash
+			:rtype: StreamArchive
+        """
+		uploader = StreamUploader(self, partsize, concurrency, bandwidth)
+		return uploader.upload(source, description)
+
+	def upload_compressed(self, source, description="", level=6,
+		block_size=1024*1024, compress_workers=4, partsize=1024*1024*64,
+		concurrency=4, bandwidth=None):
+		"""
+            Compresses an archive or a stream on the fly and uploads it
+			as a container of compressed blocks (glacier.compress)
+
+			Blocks are compressed on ``compress_workers`` threads and
+			streamed into upload_stream, the parts are hashed after
+			compression. The index of the blocks is appended to the
+			archive and kept in the returned archive, with it a range of
+			the original data is restored by retrieving only the blocks
+			holding it (BlockIndex.retrieval_range and extract).
+
+			:param source: An archive initialized with a file name, a
+			file-like object or an iterator of strings
+			:param description: Description of the archive (optional)
+			:param level: zlib compression level, 1 (fast) to 9 (small)
+			:param block_size: Bytes of the original data per block
+			:param compress_workers: Number of blocks compressed at once
+			:param partsize: Bytes per part of the compressed archive
+			:param concurrency: Number of parts uploaded at the same time
+			:param bandwidth: BandwidthLimiter shared by the parts of this
+			upload (optional)
+
+			:return: The archive with its id, size, tree hash and block
+			index (archive.index)
+			:rtype: StreamArchive
+        """
+		if isinstance(source, Archive):
+			local = source
+			source = (str(local.read(offset, block_size))
+				for offset in xrange(0, local.size, block_size))
+		compressor = Compressor(block_size, compress_workers, level)
+		archive = self.upload_stream(compressor.compress(source), description,
+			partsize, concurrency, bandwidth)
+		archive.index = compressor.index
+		return archive
+
+	def resume_multipart_upload(self, archive, journal):
+		"""
+            Picks up the multi-part upload recorded in a journal
+
+			The parts Glacier has stored are compared with the tree
+			hashes recorded in the journal, only matching parts count as
+			done.
+
+			:param archive: An archive initialized with a file name
+			:param journal: The journal of the upload
+			:type journal: UploadJournal
+
+			The upload of a journal that belongs to a different archive
+			is aborted, it would never be completed.
+
+			:return: Numbers of the parts that are stored already or None
+			if the upload can't be resumed
+			:rtype: set
+        """
+		if journal.upload_id is None:
+			return None
+
+		archive.multi_part_id = journal.upload_id
+		if not journal.matches(archive):
+			try:
+				self.abort_multipart_upload(archive)
+			except ResponseError, e:
+				if e.status != 404:
+					raise
+			del archive.multi_part_id
+			return None
+
+		try:
+			stored = self.stored_parts(archive)
+		except ResponseError, e:
+			# Glacier forgets uploads after 24 hours of inactivity
+			if e.status == 404:
+				del archive.multi_part_id
+				return None
+			raise
+
+		# The journal matches the archive, its hashes are the ones of
+		# the local file
+		return set([part for part, treehash in stored.items()
+			if part < len(journal.part_treehashes) and
+			treehash == journal.part_treehashes[part]])
+
+	def stored_parts(self, archive):
+		"""
+            Returns the tree hash of every part Glacier has stored for the
+			multi-part upload of the archive, following all pages
+
+			:rtype: dictionary (part number, tree hash)
+        """
+		parts = {}
+		for part in self.iter_upload_parts(archive):
+			start = int(part["RangeInBytes"].split("-")[0])
+			parts[start / archive.partsize] = part["SHA256TreeHash"]
+		return parts
+
+	def iter_upload_parts(self, archive, limit=None):
+		"""
+            Yields the parts uploaded to a multi-upload, the pages are
+			requested while the parts are read
+
+			:param limit: Parts per page (optional)
+			:rtype: iterator of dictionaries
+        """
+		return paginate(lambda marker: self.list_upload_parts(archive,
+			marker=marker, limit=limit), "Parts")
+
+	def list_upload_parts(self, archive, marker=None, limit=None):
 		"""
             Lists the parts uploaded to a multi-upload
             
+			:param marker: Marker of the page to list (optional)
+			:param limit: Maximum number of parts to list (optional)
+
 			:return: Parsed answer from Amazon Glacier
 			:rtype: dictionary
         """
-		req = self.connection.make_request(	"GET",
-											"/-/vaults/"+self.name
-											+"/multipart-uploads/"+archive.multi_part_id)
+		path = "/-/vaults/"+self.name+"/multipart-uploads/"+archive.multi_part_id
+		query = utils.query_string({ "marker":marker, "limit":limit })
+		if query:
+			path += "?" + query
+		req = self.connection.make_request(	"GET", path)
 		resp = req.send_request()
 	
 		if resp.status != 200:
-			raise Exception("could not get uploads", resp)
+			raise ResponseError("could not get uploads", resp)
 
 		return json.loads(resp.read())
 
@@ -181,10 +498,11 @@ class Vault(object):
 		resp = req.send_request()
 
 		if resp.status != 201:
-			raise Exception("error completing the multi-part transfer", resp)
+			raise ResponseError("error completing the multi-part transfer", resp)
 
 		# assign the id to the archive
 		archive.id = resp.getheader("x-amz-archive-id")
+		self.index_archive(archive, getattr(archive, "description", ""))
 		return archive.id
 
 	def abort_multipart_upload(self, archive):
@@ -199,7 +517,7 @@ class Vault(object):
 		resp = req.send_request()
 
 		if resp.status != 204:
-			raise Exception("could not delete " + archive.multi_part_id, resp)
+			raise ResponseError("could not delete " + archive.multi_part_id, resp)
 
 	def delete(self, archive):
 		"""
@@ -213,7 +531,91 @@ class Vault(object):
 		resp = req.send_request()
 
 		if resp.status != 204:
-			raise Exception("could not delete " + archive.id, resp)
+			raise ResponseError("could not delete " + archive.id, resp)
+
+		if self.connection.index is not None:
+			self.connection.index.remove(self.name, archive.id)
+
+	def index_archive(self, archive, description=""):
+		"""
+            Records a stored archive in the index of the connection
+        """
+		if self.connection.index is not None:
+			self.connection.index.add(self.name, archive.id,
+				archive.treehash, archive.size, description)
+
+	def load_inventory(self, jid):
+		"""
+            Loads the output of an inventory job into the index of the
+			connection, streaming it
+
+			:param jid: The job id of an ``inventory-retrieval`` job
+			:return: Number of archives loaded
+			:rtype: integer
+        """
+		if self.connection.index is None:
+			raise Exception("the connection has no index")
+		resp = self.job_output_response(jid)
+		content_type = resp.getheader("Content-Type") or ""
+		reader = InventoryReader(resp, "csv" if "csv" in content_type
+			else "json")
+		try:
+			return self.connection.index.load_inventory(self.name, reader)
+		finally:
+			resp.close()
+
+	def upload_unique(self, archive, description="", concurrency=4):
+		"""
+            Uploads an archive unless the index knows an archive with the
+			same tree hash and size in this vault
+
+			Single-part archives are uploaded in one request, bigger
+			ones with upload_multipart.
+
+			:param archive: An archive initialized with a file name
+			:param description: Description of the archive (optional)
+
+			:return: The archive, its id is the one of the stored copy if
+			the upload was skipped
+			:rtype: archive
+        """
+		if self.connection.index is not None:
+			stored = self.connection.index.lookup(self.name, archive.treehash,
+				archive.size)
+			if stored:
+				archive.id = stored
+				return archive
+
+		if archive.partcount > 1:
+			self.upload_multipart(archive, concurrency, description)
+		else:
+			self.upload(archive, description)
+		return archive
+
+	def upload_many(self, paths, concurrency=4, hash_workers=2,
+		progress=None):
+		"""
+            Uploads files and whole directory trees
+
+			Scanning, hashing and uploading run as overlapping stages,
+			the parts of all archives share one pool of ``concurrency``
+			upload threads (see UploadScheduler). A file that fails
+			doesn't stop the others.
+
+			:param paths: Files and directories to upload
+			:param concurrency: Number of uploads and parts in flight
+			:param hash_workers: Number of files hashed at the same time
+			:param progress: Called with the throughput and queue depths
+			after every archive (optional)
+			:type paths: list of strings
+
+			:return: The uploaded archives and the error of every file
+			that failed
+			:rtype: tuple (list, dictionary)
+        """
+		scheduler = UploadScheduler(self, concurrency, hash_workers,
+			progress=progress)
+		return scheduler.run(paths)
 
 	# Notifications
 
@@ -238,7 +640,7 @@ class Vault(object):
 		resp = req.send_request()
 
 		if resp.status != 204:
-			raise Exception("could not set notifications", resp)
+			raise ResponseError("could not set notifications", resp)
 
 	def get_notifications(self):
 		"""
@@ -253,7 +655,7 @@ class Vault(object):
 		resp = req.send_request()
 	
 		if resp.status != 200:
-			raise Exception("could not get notifications", resp)
+			raise ResponseError("could not get notifications", resp)
 
 		return json.loads(resp.read())
 
@@ -267,11 +669,12 @@ class Vault(object):
 		resp = req.send_request()
 
 		if resp.status != 204:
-			raise Exception("could not delete notifications", resp)
+			raise ResponseError("could not delete notifications", resp)
 
 	# Jobs 
 
-	def initiate_job(self, jtype, description="", archive=None, snstopic=""):
+	def initiate_job(self, jtype, description="", archive=None, snstopic="",
+		inventory_format=None, byte_range=None):
 		"""
             Initiates a job executed in the vault
             
@@ -282,11 +685,17 @@ class Vault(object):
 			``archive-retrieval``)
 			:param snstopic: SNS topic where a notification is sent to on
 			completion
+			:param inventory_format: Format of the inventory, ``JSON`` or
+			``CSV`` (optional)
+			:param byte_range: Megabyte aligned range of the archive to
+			retrieve, e.g. ``0-1048575`` (optional)
 			
 			:type jtype: string
 			:type description: string
 			:type archive: string
 			:type snstopic: string
+			:type inventory_format: string
+			:type byte_range: string
 
 			:return: job id
 			:rtype: string
@@ -302,6 +711,10 @@ class Vault(object):
 			jobr["SNSTopic"] = snstopic
 		if jtype == "archive-retrieval":
 			jobr["ArchiveId"] = archive.id
+		if inventory_format:
+			jobr["Format"] = inventory_format
+		if byte_range:
+			jobr["RetrievalByteRange"] = byte_range
 
 		header = { "Content-Length":str(len(json.dumps(jobr))) }
 		req = self.connection.make_request(	"POST",
@@ -311,7 +724,7 @@ class Vault(object):
 		resp = req.send_request()
 
 		if resp.status != 202:
-			raise Exception("could not initiate job", resp)
+			raise ResponseError("could not initiate job", resp)
 
 		return resp.getheader("x-amz-job-id")
 			
@@ -329,23 +742,53 @@ class Vault(object):
 		req = self.connection.make_request(	"GET",
 											"/-/vaults/"+self.name+"/jobs/"+jid)
 		resp = req.send_request()
-		if resp.status != 201 or resp.status!=200:
-			pass
-		else:
-			raise Exception("could not describe job", resp)
+		if resp.status != 200:
+			raise ResponseError("could not describe job", resp)
 		return json.loads(resp.read())
 
-	def get_job_output(self, jid, byte_range="-1", output="json"):
+	def get_job_output(self, jid, byte_range="-1", output="json",
+		bandwidth=None):
 		"""
             Gets the job output
             
 			:param jid: The job id
 			:param byte_range: Byte range to get (optional)
+			:param bandwidth: BandwidthLimiter of the transfer (optional)
 			:type jid: string
 			:type byte_range: string
 
 			:return: Parsed answer from Amazon Glacier
 			:rtype: dictionary
+        """
+		if output not in ("json", "raw"):
+			raise Exception("invalid output format", output)
+
+		# The range is requested again if it fails or breaks off
+		def attempt():
+			resp = self.job_output_response(jid, byte_range, bandwidth)
+			data = resp.read()
+			length = resp.getheader("Content-Length")
+			if length is not None and len(data) != int(length):
+				raise TransferError("job output ended early at byte " +
+					str(len(data)))
+			return data
+
+		data = self.connection.retry.call(attempt)
+		if output == 'json':
+			return json.loads(data)
+		return data
+
+	def job_output_response(self, jid, byte_range="-1", bandwidth=None):
+		"""
+            Requests the job output and returns the response before its
+			body is read, so it can be streamed
+
+			:param jid: The job id
+			:param byte_range: Byte range to get (optional)
+			:param bandwidth: BandwidthLimiter the body is read through
+			(optional)
+			:type jid: string
+			:type byte_range: string
         """
 		header = {}
 		if byte_range != "-1":
@@ -354,30 +797,166 @@ class Vault(object):
 		req = self.connection.make_request(	"GET",
 											"/-/vaults/"+self.name+"/jobs/"
 											+jid+"/output",
-											header=header)
+											header=header,
+											bandwidth=bandwidth)
 		resp = req.send_request()
 		
-		if resp.status != 200:
-			raise Exception("could not get job output", resp)
-		if output == 'json':
-			return json.loads(resp.read())
-		elif output == 'raw':
-			return resp.read()
+		if resp.status not in (200, 206):
+			raise ResponseError("could not get job output", resp)
+		return resp
+
+	def iter_inventory(self, jid, inventory_format=None):
+		"""
+            Yields the archives of an inventory one at a time while the
+			job output arrives, the memory use stays flat no matter how
+			big the vault is
+
+			:param jid: The job id of an ``inventory-retrieval`` job
+			:param inventory_format: ``json`` or ``csv``, taken from the
+			content type of the output if not given
+			:type jid: string
+
+			:return: Entries of the ArchiveList
+			:rtype: iterator of dictionaries
+        """
+		resp = self.job_output_response(jid)
+		if inventory_format is None:
+			content_type = resp.getheader("Content-Type") or ""
+			inventory_format = "csv" if "csv" in content_type else "json"
+		try:
+			for entry in InventoryReader(resp, inventory_format.lower()):
+				yield entry
+		finally:
+			resp.close()
+
+	def download_job_output(self, jid, path, concurrency=4,
+		range_size=1024*1024*64, bandwidth=None):
+		"""
+            Downloads the job output straight into a file
+
+			The output is split into byte ranges which are fetched at
+			the same time and written into the file at their offset.
+			Each range is tree hashed while it arrives, so every worker
+			only holds 1 MB of it in memory.
+
+			:param jid: The job id
+			:param path: File the output is written to
+			:param concurrency: Number of ranges fetched at the same time
+			:param range_size: Bytes per range, a power of two multiple
+			of 1 MB so that the ranges are tree hash aligned
+			:param bandwidth: BandwidthLimiter shared by the ranges of
+			this download (optional)
+			:type jid: string
+			:type path: string
+
+			:return: Tree hash of the downloaded output
+			:rtype: string
+        """
+		chunk_size = 1024*1024
+		ranges = range_size / chunk_size
+		if range_size % chunk_size or ranges & (ranges - 1):
+			raise ValueError("range size must be a power of two multiple " +
+				"of 1 MB")
+
+		job = self.describe_job(jid)
+		if job.get("Action") == "InventoryRetrieval":
+			size = job["InventorySizeInBytes"]
+		elif job.get("RetrievalByteRange"):
+			first, last = job["RetrievalByteRange"].split("-")
+			size = int(last) - int(first) + 1
 		else:
-			raise Exception("invalid output format", output)
+			size = job["ArchiveSizeInBytes"]
+
+		# Allocate the whole file up front, each worker then writes
+		# its ranges through its own file handle
+		with open(path, "wb") as output:
+			output.truncate(size)
+
+		count = (size + range_size - 1) / range_size
+		treehashes = [None] * count
+
+		def fetch(index):
+			start = index * range_size
+			end = min(start + range_size, size) - 1
+			resp = self.job_output_response(jid,
+				"bytes=" + str(start) + "-" + str(end), bandwidth)
+			hasher = utils.TreeHasher()
+			try:
+				with open(path, "r+b") as output:
+					output.seek(start)
+					remaining = end - start + 1
+					while remaining > 0:
+						data = resp.read(min(chunk_size, remaining))
+						if not data:
+							raise TransferError("job output ended early at byte " +
+								str(end - remaining + 1))
+						output.write(data)
+						hasher.update(data)
+						remaining -= len(data)
+			finally:
+				resp.close()
+
+			treehashes[index] = hasher.hexdigest()
+			expected = resp.getheader("x-amz-sha256-tree-hash")
+			if expected and expected != treehashes[index]:
+				raise TransferError("tree hash mismatch in range " +
+					str(start) + "-" + str(end))
+
+		# A range that fails is fetched and written again on its own
+		run_parallel(lambda index: self.connection.retry.call(fetch, index),
+			range(count), concurrency)
+
+		# The ranges are tree hash aligned, their hashes make up the
+		# hash of the whole output
+		if treehashes:
+			treehash = utils.combine_tree_hashes(treehashes)
+		else:
+			treehash = utils.TreeHasher().hexdigest()
+
+		if job.get("SHA256TreeHash") and job["SHA256TreeHash"] != treehash:
+			raise Exception("tree hash mismatch in job output", job)
+		return treehash
 
-	def list_jobs(self):
+	def list_jobs(self, completed=None, statuscode=None, marker=None,
+		limit=None):
 		"""
-            Lists all jobs for this vault
+            Lists the jobs of this vault, one page at a time
+
+			:param completed: Only completed (True) or pending (False)
+			jobs (optional)
+			:param statuscode: Only jobs with this status, ``InProgress``,
+			``Succeeded`` or ``Failed`` (optional)
+			:param marker: Marker of the page to list (optional)
+			:param limit: Maximum number of jobs to list (optional)
 
 			:return: Parsed answer from Amazon Glacier
 			:rtype: dictionary
         """
-		req = self.connection.make_request(	"GET",
-											"/-/vaults/"+self.name+"/jobs")
+		if completed is not None:
+			completed = "true" if completed else "false"
+		path = "/-/vaults/"+self.name+"/jobs"
+		query = utils.query_string({ "completed":completed,
+			"statuscode":statuscode, "marker":marker, "limit":limit })
+		if query:
+			path += "?" + query
+		req = self.connection.make_request(	"GET", path)
 		resp = req.send_request()
 
 		if resp.status != 200:
-			raise Exception("could not get list jobs", resp)
+			raise ResponseError("could not get list jobs", resp)
 
 		return json.loads(resp.read())
+
+	def iter_jobs(self, completed=None, statuscode=None, limit=None):
+		"""
+            Yields the jobs of this vault, the pages are requested while
+			the jobs are read
+
+			:param completed: Only completed (True) or pending (False)
+			jobs (optional)
+			:param statuscode: Only jobs with this status (optional)
+			:param limit: Jobs per page (optional)
+			:rtype: iterator of dictionaries
+        """
+		return paginate(lambda marker: self.list_jobs(completed, statuscode,
+			marker, limit), "JobList")
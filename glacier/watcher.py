@@ -0,0 +1,283 @@
+# Glacier
+# Copyright 2012 Paul Engstler
+# See LICENSE for details.
+
+import sys, json, threading, Queue
+from asynchronous import Operation
+
+class JobFuture(Operation):
+	""" Result of a watched job, the description of the completed job """
+
+	def __init__(self, watcher, vault, jid):
+		Operation.__init__(self, watcher)
+		self.vault = vault
+		self.job_id = jid
+		self._event = threading.Event()
+
+	def _finish(self):
+		self._event.set()
+		Operation._finish(self)
+
+class JobWatcher(object):
+	"""
+
+		Waits for many jobs, in any number of vaults, at once.
+
+		Instead of describing every job on its own, each round lists the
+		completed jobs of a vault page by page until all watched jobs of
+		the vault were seen, a single request for most rounds. The
+		interval between rounds grows while nothing completes and drops
+		back to ``min_interval`` once something does.
+
+		With a notification queue no listing is done at all, the watcher
+		waits for the job notifications Glacier sends to the SNS topic of
+		the job instead. Anything with a get(block, timeout) method will
+		do, e.g. a Queue.Queue filled by an SQS consumer. The messages
+		are job descriptions, as dictionaries or JSON, optionally wrapped
+		in an SNS envelope.
+
+		A watched job is a JobFuture. Its result is the description of
+		the job, a failed job raises an error. The watcher either runs
+		in the thread asking for a result or in a thread of its own
+		(start).
+
+		Outputs are downloaded by a few threads of their own, a long
+		download doesn't hold up the rounds. The future of a job with a
+		download is done once its output is on disk.
+
+	"""
+
+	def __init__(self, min_interval=60, max_interval=900, backoff=2.0,
+		notifications=None, downloads=2):
+		"""
+            :param min_interval: Seconds between the first rounds
+			:param max_interval: Highest number of seconds between rounds
+			:param backoff: Factor the interval grows by after a round
+			without completed jobs
+			:param notifications: Queue of job notifications used instead
+			of listing the jobs (optional)
+			:param downloads: Number of outputs downloaded at the same time
+        """
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.backoff = backoff
+		self.interval = min_interval
+		self.notifications = notifications
+		self.downloads = downloads
+		self.jobs = {}
+		self.requests = 0
+		self._lock = threading.Lock()
+		# Notified whenever a job or a download is done
+		self._changed = threading.Condition(self._lock)
+		self._downloading = 0
+		self._download_queue = Queue.Queue()
+		self._downloaders = []
+		self._wakeup = threading.Event()
+		self._stopped = False
+		self._thread = None
+
+	def watch(self, vault, jid, callback=None, download=None):
+		"""
+            Watches a job
+
+			:param vault: Vault the job runs in
+			:param jid: The job id
+			:param callback: Called with the future once the job is done
+			(optional)
+			:param download: Path the output is downloaded to as soon as
+			the job succeeded (optional)
+			:type vault: Vault
+
+			:rtype: JobFuture
+        """
+		future = JobFuture(self, vault, jid)
+		if callback is not None:
+			future.add_done_callback(callback)
+		with self._lock:
+			self.jobs[jid] = (future, download)
+		# A new job is looked for right away, not after a long interval
+		self.interval = self.min_interval
+		self._wakeup.set()
+		return future
+
+	def pending(self):
+		"""
+            Returns the number of jobs that are not done yet, including
+			the ones whose output is being downloaded
+        """
+		with self._lock:
+			return len(self.jobs) + self._downloading
+
+	def poll(self):
+		"""
+            Lists the completed jobs of every vault with watched jobs once
+
+			:return: Number of jobs that completed
+			:rtype: integer
+        """
+		vaults = {}
+		with self._lock:
+			for jid, (future, _) in self.jobs.items():
+				vaults.setdefault(future.vault, set()).add(jid)
+
+		completed = 0
+		for vault, jids in vaults.items():
+			marker = None
+			while jids:
+				page = vault.list_jobs(completed=True, marker=marker)
+				self.requests += 1
+				for job in page.get("JobList", []):
+					if job["JobId"] in jids:
+						jids.discard(job["JobId"])
+						completed += self.complete(job)
+				marker = page.get("Marker")
+				if not marker:
+					break
+		return completed
+
+	def receive(self, timeout):
+		"""
+            Waits for one notification and handles it
+
+			:return: Number of jobs that completed
+			:rtype: integer
+        """
+		try:
+			message = self.notifications.get(True, timeout)
+		except Queue.Empty:
+			return 0
+		if isinstance(message, basestring):
+			message = json.loads(message)
+		# SNS wraps the job description in an envelope
+		if "Message" in message:
+			message = json.loads(message["Message"])
+		if not message.get("Completed"):
+			return 0
+		return self.complete(message)
+
+	def complete(self, job):
+		"""
+            Finishes the future of a completed job. If its output is to
+			be downloaded the download is queued, one of the download
+			threads finishes the future.
+        """
+		with self._lock:
+			entry = self.jobs.pop(job["JobId"], None)
+			if entry is None:
+				return 0
+			future, download = entry
+			succeeded = job.get("StatusCode") == "Succeeded"
+			if succeeded and download is not None:
+				self._downloading += 1
+				while len(self._downloaders) < self.downloads:
+					thread = threading.Thread(target=self._download)
+					thread.daemon = True
+					thread.start()
+					self._downloaders.append(thread)
+				self._download_queue.put((future, job, download))
+				return 1
+		if not succeeded:
+			error = Exception("job failed", job)
+			future.set_error((Exception, error, None))
+		else:
+			future.set_result(job)
+		self._notify()
+		return 1
+
+	def _download(self):
+		while True:
+			item = self._download_queue.get()
+			if item is None:
+				return
+			future, job, path = item
+			try:
+				future.vault.download_job_output(job["JobId"], path)
+			except Exception:
+				future.set_error(sys.exc_info())
+			else:
+				future.set_result(job)
+			finally:
+				with self._lock:
+					self._downloading -= 1
+				self._notify()
+
+	def _notify(self):
+		with self._changed:
+			self._changed.notify_all()
+
+	def step(self):
+		"""
+            Runs one round, waiting for the interval if it found nothing
+        """
+		if self.notifications is not None:
+			self.receive(self.interval)
+			return
+		# Cleared first, a job watched during the round cuts the wait
+		self._wakeup.clear()
+		if self.poll():
+			self.interval = self.min_interval
+		else:
+			wait = self.interval
+			self.interval = min(self.max_interval, wait * self.backoff)
+			self._wakeup.wait(wait)
+
+	def run(self, until=None):
+		"""
+            Watches until all jobs, downloads included, or the given
+			future are done. With a thread of its own (start) the
+			watcher only waits for that.
+        """
+		if self._thread is not None and \
+			self._thread is not threading.current_thread():
+			if until is not None:
+				until._event.wait()
+			else:
+				with self._changed:
+					while self.jobs or self._downloading:
+						self._changed.wait()
+			return
+		while until is None or not until.done():
+			with self._changed:
+				if not self.jobs:
+					if not self._downloading:
+						return
+					# Nothing to watch, the downloads are left
+					self._changed.wait()
+					continue
+			self.step()
+
+	def start(self):
+		"""
+            Watches in a thread of its own until stop is called
+        """
+		def loop():
+			while not self._stopped:
+				self._wakeup.clear()
+				with self._lock:
+					watching = bool(self.jobs)
+				if watching:
+					self.step()
+				else:
+					self._wakeup.wait(self.max_interval)
+		self._stopped = False
+		self._thread = threading.Thread(target=loop)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		"""
+            Ends the thread of start and the download threads, downloads
+			under way are finished first
+        """
+		self._stopped = True
+		self._wakeup.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		with self._lock:
+			downloaders = self._downloaders
+			self._downloaders = []
+		for thread in downloaders:
+			self._download_queue.put(None)
+		for thread in downloaders:
+			thread.join()